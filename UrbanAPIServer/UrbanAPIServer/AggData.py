@@ -1,16 +1,47 @@
-import requests
-from IPython.display import GeoJSON
 import pandas as pd
-import io
-import seaborn as sns
+import threading
 import numpy as np
 from datetime import datetime, timedelta
 
-from pathlib import Path
+from DataCache import data_cache
+from DataStore import data_store
+from Decimation import decimate
+from Frames import concat_frames
+from RemoveOutliers import online_outliers
+from RollingAverages import rolling_averages
+from SensorRegistry import sensor_registry
+from UpstreamClient import upstream
+
+
+# Variables and windows offered by the dashboard, and kept warm by the prefetcher
+VARIABLES = ['PM2.5', 'PM10', 'O3', 'NO2', 'Humidity', 'Wind Speed', 'CO']
+DAY_OPTIONS = [1, 3, 7, 28]
+
+AGG_PERIOD_DELTAS = {
+    '15mins': timedelta(minutes=15),
+    '1hour': timedelta(hours=1),
+}
+
+# Downsampling frequencies, finest first. A budget of 120 points per sensor gives 15min for a day, 1h for 3 days,
+# 2h for a week and 6h for 28 days
+DOWNSAMPLE_FREQUENCIES = ['15min', '30min', '1h', '2h', '3h', '6h', '12h', '1D', '7D']
+DEFAULT_POINT_BUDGET = 120
+
+# The prefetcher doesn't re-request the tail if the stored series was fetched less than this long ago
+MIN_TAIL_INTERVAL = timedelta(seconds=60)
 
 
 class AggData:
     instances = []
+    # Stored frame and fetched range per (variable, agg_method, agg_period), shared across windows
+    # Frames are held compact, with a 'Sensor ID' in place of the name and centroid columns, see SensorRegistry
+    series = {}
+    series_locks = {}
+    series_lock = threading.Lock()
+    # End of the stored data last read by sync_from_store per series, in this process
+    synced = {}
+    # End of the series each cached window was cut from, per cache key, in this process
+    window_ends = {}
     data_params = {}
     df = pd.DataFrame()
     df_downsampled = pd.DataFrame()
@@ -18,19 +49,15 @@ class AggData:
     days = 0
     units = ""
 
-    def __init__(self, variable, _days=1):
+    def __init__(self, variable, _days=1, register=True):
         self.days = _days
+        self.data_params = self.build_data_params(variable, _days)
 
-        self.data_params = dict(
-            data_variable=variable,
-            agg_method='median',
-            agg_period='15mins',
-            starttime=(datetime.now() - timedelta(days=_days)).strftime("%Y%m%d%H%M%S"),
-            endtime=datetime.now().strftime("%Y%m%d%H%M%S"),
-            sensor_type=variable
-        )
-
-        self.df = self.fetch_agg_data(self.data_params)
+        # Serve from the shared cache. Expanding the compact frame copies it, so downsampling can't mutate the cache
+        # The version comes with the frame it belongs to, it keys the ETag and the derived caches
+        self.drop_if_behind_store()
+        df, self.version = data_cache.get_or_load(self.cache_key(), self.fetch_window)
+        self.df = sensor_registry.expand(df)
 
         try:
             self.units = self.df["Units"].iloc[0]  # Set units attribute
@@ -42,65 +69,435 @@ class AggData:
             self.units = ""
 
         self.df_downsampled = self.df
-        AggData.instances.append(self)
+        # Short-lived instances, e.g. one per API request, shouldn't be kept around for reuse
+        if register:
+            AggData.instances.append(self)
 
-    def fetch_agg_data(self, data_params):
-        # Set up filename with variable and number of days
-        csv_filename = f"{data_params['data_variable']}_{(datetime.now() - datetime.strptime(data_params['starttime'], '%Y%m%d%H%M%S')).days}_days.csv"
-        csv_path = Path(csv_filename)
+    @staticmethod
+    def build_data_params(variable, _days):
+        return dict(
+            data_variable=variable,
+            agg_method='median',
+            agg_period='15mins',
+            starttime=(datetime.now() - timedelta(days=_days)).strftime("%Y%m%d%H%M%S"),
+            endtime=datetime.now().strftime("%Y%m%d%H%M%S"),
+            sensor_type=variable
+        )
 
-        try:
-            # Attempt to fetch data from API
-            r = requests.get('http://uoweb3.ncl.ac.uk/api/v1.1/sensors/data/agg/csv/', data_params)
+    @classmethod
+    def refresh(cls, variable, _days=1):
+        """
+        Re-fetches a window into the shared cache, for the background prefetcher.
+
+        Unlike the constructor this bypasses the cache, lets upstream errors through instead of falling back to
+        stored data, and doesn't register an instance.
+
+        Parameters:
+        - variable (str): Data variable to refresh.
+        - _days (int, optional): Window length in days. Defaults to 1.
+
+        Returns:
+        - DataFrame: The refreshed window, in compact form.
+        """
+
+        instance = cls.__new__(cls)
+        instance.days = _days
+        instance.data_params = cls.build_data_params(variable, _days)
+        df = instance.fetch_window(raise_errors=True, max_age=MIN_TAIL_INTERVAL)
+        data_cache.put(instance.cache_key(), df)
+        return df
+
+    @classmethod
+    def fetch_many(cls, variables, _days=1):
+        """
+        Creates AggData instances for several variables concurrently, so N variables cost roughly one round trip.
+
+        Parameters:
+        - variables (list): Data variables to fetch, e.g. ['PM2.5', 'PM10', 'NO2'].
+        - _days (int, optional): Number of days of data to fetch for each variable. Defaults to 1.
+
+        Returns:
+        - list: AggData instances in the same order as variables.
+        """
+
+        return upstream.map(lambda variable: cls(variable, _days), variables)
+
+    @classmethod
+    def sync_from_store(cls, variable):
+        """
+        Feeds rows stored since this process last saw the variable into the running 24h averages and the sensor
+        registry, without touching the upstream API.
+
+        Under a multi-process server only one worker refreshes each series, so the others would otherwise have no
+        averages or sensors for it until a request of their own fetched it.
+
+        Parameters:
+        - variable (str): Data variable to catch up on.
+
+        Returns:
+        - None
+        """
+
+        key = (variable, 'median', '15mins')
+        coverage = data_store.coverage(key)
+        if coverage is None:
+            return
+
+        with cls.series_lock:
+            seen = [end for end in (cls.synced.get(key), cls.series.get(key, {}).get('end')) if end is not None]
+            if seen and max(seen) >= coverage[1]:
+                return
+            cls.synced[key] = coverage[1]
+
+        # Only the buckets still inside the window matter, and the last seen one may have been re-aggregated
+        start = max(coverage[0], coverage[1] - rolling_averages.window)
+        if seen:
+            start = max(start, max(seen) - AGG_PERIOD_DELTAS[key[2]])
+        df = data_store.read(key, start, coverage[1])
+        if df.empty:
+            return
+        sensor_registry.register(df)
+        rolling_averages.update(variable, df)
+
+    def cache_key(self):
+        return (self.data_params['data_variable'], self.data_params['agg_method'], self.data_params['agg_period'],
+                self.days)
+
+    def series_key(self):
+        return self.data_params['data_variable'], self.data_params['agg_method'], self.data_params['agg_period']
+
+    def drop_if_behind_store(self):
+        """
+        Drops this window from the shared cache if the store holds rows past the end it was cut from.
+
+        Another worker process may have extended the series, e.g. the one that refreshed it and sent the live
+        'updated' notice. Without this the cached window, and its ETag, would be served until the cache entry expired.
+        """
+
+        built_to = AggData.window_ends.get(self.cache_key())
+        if built_to is None:
+            return
+        coverage = data_store.coverage(self.series_key())
+        if coverage is not None and coverage[1] > built_to:
+            data_cache.invalidate(self.cache_key())
+
+    def fetch_window(self, raise_errors=False, max_age=None):
+        """
+        Returns the requested window, fetching only the tail since the last fetch for this variable.
+
+        The stored series for each variable is shared by every window, so a 28-day view and a 1-day view both
+        extend the same frame. New rows replace any overlapping (Sensor Name, Timestamp) rows and the head is
+        trimmed to the longest window requested so far. Rows another worker process has written to the store are
+        read from there, and only the span after them is requested from the API.
+
+        Parameters:
+        - raise_errors (bool, optional): Raise upstream errors rather than serving stored data. Defaults to False.
+        - max_age (timedelta, optional): How old the stored data may get before its tail is requested from the API.
+          Defaults to None, one aggregation period, so without the prefetcher a series lags the API by at most
+          one period.
+
+        Returns:
+        - DataFrame: Rows of the stored series that fall inside this instance's window, in compact form.
+        """
+
+        key = self.series_key()
+        with AggData.series_lock:
+            lock = AggData.series_locks.setdefault(key, threading.Lock())
+
+        # The store lock also covers other worker processes, so only one of them fetches a series at a time and the
+        # rest pick up its result from the store
+        with lock, data_store.series_lock(key):
+            window_start = datetime.strptime(self.data_params['starttime'], '%Y%m%d%H%M%S')
+            window_end = datetime.strptime(self.data_params['endtime'], '%Y%m%d%H%M%S')
+            stored = AggData.series.get(key)
+            if stored is None:
+                # Warm start from the local store, so only the tail since the last run is fetched
+                stored = self.load_stored_window(window_start)
 
-            # If site down for maintenance, catch
-            if r.text.startswith("<!doctype html>\n<title>Site Maintenance</title>"):
-                raise Exception("Maintenance")
+            if stored is None or stored['start'] > window_start:
+                # Nothing stored yet, or the stored frame doesn't reach back far enough
+                df, start, end = self.fetch_agg_data(self.data_params, fallback=not raise_errors)
+                stored = dict(df=self.ingest(df), start=start, end=end, days=self.days)
             else:
-                # Else set up dataframe and update csv
-                df = pd.read_csv(io.StringIO(r.text))
-                df.to_csv(csv_path, index=False)
-                return df
+                period = AGG_PERIOD_DELTAS[self.data_params['agg_period']]
+                coverage = data_store.coverage(key)
+                if coverage is not None and coverage[1] > stored['end']:
+                    # Another worker process has fetched further, e.g. the prefetcher, read its rows from the store.
+                    # The last period we hold is read again, its median may have changed since
+                    tail = data_store.read(key, stored['end'] - period, coverage[1])
+                    stored = self.merge_tail(stored, tail, coverage[1])
+
+                if window_end - stored['end'] >= (max_age or period):
+                    # Request only what nobody has fetched yet, re-requesting the last period too
+                    tail_start = stored['end'] - period
+                    try:
+                        tail = self.request_agg_data(dict(self.data_params,
+                                                          starttime=tail_start.strftime("%Y%m%d%H%M%S")))
+                        data_store.write(key, tail, stored['end'], window_end)
+                        stored = self.merge_tail(stored, tail, window_end)
+                    except Exception as e:
+                        if raise_errors:
+                            raise
+                        # Keep serving what we already have
+                        print(f"Keeping stored data for {key[0]} due to API error: {e}")
+
+            # Trim the head to the longest window requested for this variable
+            stored['days'] = max(stored['days'], self.days)
+            head = stored['end'] - timedelta(days=stored['days'])
+            if stored['start'] < head and 'Timestamp' in stored['df']:
+                stored['df'] = stored['df'][stored['df']['Timestamp'] >= head].reset_index(drop=True)
+                stored['start'] = head
+            AggData.series[key] = stored
+            AggData.window_ends[self.cache_key()] = stored['end']
+
+            if 'Timestamp' not in stored['df']:
+                return stored['df']
+            return stored['df'][stored['df']['Timestamp'] >= window_start].reset_index(drop=True)
+
+    def merge_tail(self, stored, tail, end):
+        """
+        Returns the stored series entry extended with tail, rows fetched or read up to end. Tail rows replace any
+        overlapping (Sensor ID, Timestamp) rows.
+        """
+
+        df = concat_frames([stored['df'], self.ingest(tail)])
+        df = df.drop_duplicates(subset=['Sensor ID', 'Timestamp'], keep='last')
+        return dict(stored, df=df, end=end)
+
+    def ingest(self, df):
+        """
+        Prepares fetched or stored rows for the shared series: compacts them, feeds the running 24h averages and the
+        online outlier filter, and flags outliers against each sensor's current fences.
+
+        Parameters:
+        - df (DataFrame): Rows as parsed from the API or read from the local store.
+
+        Returns:
+        - DataFrame: The compact rows with an 'Outlier' column.
+        """
+
+        variable = self.data_params['data_variable']
+        df = sensor_registry.compact(df)
+        rolling_averages.update(variable, df)
+        online_outliers.observe(variable, df)
+        return online_outliers.flag(variable, df)
+
+    def request_agg_data(self, data_params):
+        """
+        Requests aggregated sensor data from the Urban Observatory API.
+
+        Parameters:
+        - data_params (dict): Query parameters for the aggregated CSV endpoint.
+
+        Returns:
+        - DataFrame: The parsed CSV with 'Timestamp' as datetimes and categorical name and unit columns.
+
+        Raises:
+        - UpstreamMaintenance: If the API is down for maintenance.
+        - requests.RequestException: If the request still fails after retrying.
+        """
+
+        return upstream.fetch_csv(data_params)
+
+    def load_stored_window(self, window_start):
+        """
+        Loads the window from the local store if the stored data reaches back to window_start.
+
+        Parameters:
+        - window_start (datetime): Start of the requested window.
+
+        Returns:
+        - dict or None: A stored series entry covering the window with a compact frame, or None if the store can't
+          cover it.
+        """
+
+        key = self.series_key()
+        coverage = data_store.coverage(key)
+        if coverage is None or coverage[0] > window_start:
+            return None
+
+        df = data_store.read(key, window_start)
+        if df.empty:
+            return None
+        print(f"Loaded {len(df)} stored rows for {key[0]} up to {coverage[1]}")
+        return dict(df=self.ingest(df), start=window_start, end=coverage[1], days=self.days)
+
+    def fetch_agg_data(self, data_params, fallback=True):
+        """
+        Fetches a range from the API into the local store, falling back to stored rows if the API fails.
+
+        Parameters:
+        - data_params (dict): Query parameters for the aggregated CSV endpoint.
+        - fallback (bool, optional): Serve stored rows on an API error instead of raising. Defaults to True.
+
+        Returns:
+        - tuple: (df, start, end), where start and end are the range the rows actually cover. For stored rows this
+          is their first and last timestamp, so the gaps either side are fetched once the API is back.
+        """
+
+        key = self.series_key()
+        start = datetime.strptime(data_params['starttime'], '%Y%m%d%H%M%S')
+        end = datetime.strptime(data_params['endtime'], '%Y%m%d%H%M%S')
+
+        try:
+            # Attempt to fetch data from API, then update the local store
+            df = self.request_agg_data(data_params)
+            data_store.write(key, df, start, end)
+            return df, start, end
         except Exception as e:
-            # If site down for maintenance, attempt to load most recent csv
-            if csv_path.exists():
-                print(f"Loading data from {csv_path} due to API error: {e}")
-                df = pd.read_csv(csv_path)
-                return df
+            if not fallback:
+                raise
+            # If site down for maintenance, attempt to load the most recent stored data
+            df = data_store.read(key, start, end)
+            if not df.empty:
+                print(f"Loading stored data for {key[0]} due to API error: {e}")
+                return df, df['Timestamp'].min().to_pydatetime(), df['Timestamp'].max().to_pydatetime()
             else:
-                raise Exception("Data not available due to API error and no local CSV file found.")
+                raise Exception("Data not available due to API error and no local data found.")
+
+    def downsample(self, aggregations=('mean',), point_budget=DEFAULT_POINT_BUDGET, frequency=None):
+        """
+        Resamples df_downsampled per sensor, in one groupby over (sensor, time bucket).
+
+        Every sensor keeps its own series, and each bucket keeps one row per sensor carrying that sensor's other
+        columns, so nothing is merged back afterwards.
+
+        Parameters:
+        - aggregations (tuple, optional): Aggregations of 'Value' per bucket, any of 'mean', 'median', 'min', 'max'
+          or a percentile such as 'p90'. The first is written to 'Value', the rest to 'Value <aggregation>' columns.
+          Defaults to ('mean',).
+        - point_budget (int, optional): Most buckets per sensor over the window, used to pick the frequency.
+          Defaults to DEFAULT_POINT_BUDGET.
+        - frequency (str, optional): Bucket frequency, overriding the point budget. Defaults to None.
+
+        Returns:
+        - None
+        """
 
-    def downsample(self):
-        days = self.days
         if self.downsampled:
             print("Data is already downsampled.")
             return
 
-        # Set target frequency based on the number of days
-        target_frequency = self.get_target_frequency(days)
+        target_frequency = frequency or self.get_target_frequency(self.days, point_budget)
+        df = self.df_downsampled
+        if df.empty or 'Timestamp' not in df:
+            self.target_frequency = target_frequency
+            return
+
+        sensor_column = 'Sensor ID' if 'Sensor ID' in df else 'Sensor Name'
+        named = {}
+        percentiles = {}
+        for i, aggregation in enumerate(aggregations):
+            column = 'Value' if i == 0 else f"Value {aggregation}"
+            if aggregation in ('mean', 'median', 'min', 'max'):
+                named[column] = ('Value', aggregation)
+            elif aggregation.startswith('p') and aggregation[1:].isdigit():
+                percentiles[column] = int(aggregation[1:]) / 100
+            else:
+                raise ValueError(f"Unknown aggregation: {aggregation}")
+
+        # The rest of a sensor's columns are constant within a bucket, keep the first
+        for column in df.columns:
+            if column not in (sensor_column, 'Timestamp', 'Value'):
+                named[column] = (column, 'first')
 
-        # Resample the data
-        self.df_downsampled['Timestamp'] = pd.to_datetime(self.df_downsampled['Timestamp'])
-        self.df_downsampled.set_index('Timestamp', inplace=True)
-        df_resampled = self.df_downsampled['Value'].resample(target_frequency).mean()
-        df_resampled = df_resampled.to_frame().reset_index()
-        df_resampled = pd.merge(df_resampled, self.df_downsampled.drop('Value', axis=1), on='Timestamp')
+        grouped = df.groupby([sensor_column, pd.Grouper(key='Timestamp', freq=target_frequency)], observed=True,
+                             sort=True)
+        df_resampled = grouped.agg(**named)
+        for column, q in percentiles.items():
+            # quantile returns float64 even for float32 values, cast back so widen_floats rounds it like 'Value'
+            df_resampled[column] = grouped['Value'].quantile(q).astype(df['Value'].dtype)
+        df_resampled = df_resampled.reset_index()
 
-        # Update the object attributes
-        self.df_downsampled = df_resampled
+        # Keep the column order of the input, with any extra aggregations after it
+        columns = [column for column in df.columns if column in df_resampled]
+        columns += [column for column in df_resampled.columns if column not in columns]
+        self.df_downsampled = df_resampled[columns]
         # self.downsampled = True
         self.target_frequency = target_frequency
         print(f"Data has been downsampled to {target_frequency} resolution.")
 
-    def get_target_frequency(self, days):
-        if days == 1:
-            return '15min'
-        elif days == 3:
-            return '1H'
-        elif days == 7:
-            return '2H'
-        else:
-            return '6H'
+    def get_target_frequency(self, days, point_budget=DEFAULT_POINT_BUDGET):
+        """
+        Picks the finest frequency that keeps a sensor's window within point_budget buckets.
+
+        Parameters:
+        - days (int): Window length in days.
+        - point_budget (int, optional): Most buckets per sensor. Defaults to DEFAULT_POINT_BUDGET.
+
+        Returns:
+        - str: A pandas frequency string, never finer than the upstream aggregation period.
+        """
+
+        window = timedelta(days=days)
+        agg_period = AGG_PERIOD_DELTAS.get(self.data_params.get('agg_period'), timedelta(0))
+        for frequency in DOWNSAMPLE_FREQUENCIES:
+            delta = pd.Timedelta(frequency)
+            if delta >= agg_period and window / delta <= point_budget:
+                return frequency
+        return DOWNSAMPLE_FREQUENCIES[-1]
+
+    def limit_points_per_sensor(self, max_points):
+        """
+        Thins df_downsampled so no sensor has more than max_points rows, keeping evenly spaced rows.
+
+        Parameters:
+        - max_points (int): Maximum number of rows to keep for each sensor.
+
+        Returns:
+        - DataFrame: The thinned frame, also stored in df_downsampled.
+        """
+
+        df = self.df_downsampled
+        if df.empty or 'Sensor Name' not in df:
+            return df
+
+        sensors = df.groupby('Sensor Name', observed=True)
+        position = sensors.cumcount()
+        step = np.ceil(sensors['Value'].transform('size') / max_points).astype(int)
+        self.df_downsampled = df[position % step == 0].reset_index(drop=True)
+        return self.df_downsampled
+
+    def decimate(self, points, method='lttb'):
+        """
+        Thins df_downsampled to about points rows per sensor, keeping the rows that preserve each series' shape.
+
+        Parameters:
+        - points (int): Target rows per sensor, e.g. the width of the chart in pixels.
+        - method (str, optional): 'lttb' or 'minmax', see Decimation. Defaults to 'lttb'.
+
+        Returns:
+        - DataFrame: The thinned frame, also stored in df_downsampled.
+        """
+
+        group = 'Sensor ID' if 'Sensor ID' in self.df_downsampled else 'Sensor Name'
+        self.df_downsampled = decimate(self.df_downsampled, points, method, group=group)
+        return self.df_downsampled
+
+    def memory_report(self):
+        """
+        Reports the memory used by this instance's frame, column by column.
+
+        Parameters:
+        - None
+
+        Returns:
+        - dict: Row count, total bytes of df, bytes of the compact form held in the shared cache (df without the
+          name and centroid columns re-attached from the registry), and dtype and bytes for each column.
+        """
+
+        usage = self.df.memory_usage(index=False, deep=True)
+        expanded = [column for column in ('Sensor Name', 'Sensor Centroid Longitude', 'Sensor Centroid Latitude')
+                    if column in usage and 'Sensor ID' in usage]
+        return {
+            'variable': self.data_params['data_variable'],
+            'days': self.days,
+            'rows': len(self.df),
+            'bytes': int(usage.sum()),
+            'compact_bytes': int(usage.drop(expanded).sum()),
+            'columns': {column: {'dtype': str(self.df[column].dtype), 'bytes': int(usage[column])}
+                        for column in self.df.columns},
+        }
 
     def get_mean_average(self):
         return self.df['Value'].mean()
@@ -0,0 +1,186 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class DataCache:
+    """
+    Process-wide cache of parsed DataFrames with TTL expiry, size-bounded LRU eviction and request coalescing.
+
+    Concurrent misses for the same key wait on a single in-flight load instead of each hitting the upstream API.
+    With stale_ttl set, get_or_load serves an expired entry for up to stale_ttl seconds past its ttl while a
+    background thread reloads it (stale-while-revalidate), so requests only wait on the upstream API when nothing
+    usable is cached.
+    """
+
+    def __init__(self, max_entries=64, ttl=15 * 60, stale_ttl=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()  # key -> (value, stored_at, version)
+        self._versions = 0
+        self._in_flight = {}  # key -> threading.Event for the load in progress
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+        self.refresh_errors = 0
+
+    def _fresh(self, stored_at):
+        return time.monotonic() - stored_at < self.ttl
+
+    def _usable(self, stored_at):
+        return time.monotonic() - stored_at < self.ttl + self.stale_ttl
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None if it is missing or expired. Counts as a hit or miss.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._fresh(entry[1]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        """
+        Stores value under key, evicting the least recently used entries when the cache is full. Returns the version
+        it was stored as.
+        """
+
+        with self._lock:
+            self._versions += 1
+            self._entries[key] = (value, time.monotonic(), self._versions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return self._versions
+
+    def get_or_load(self, key, loader):
+        """
+        Returns the cached value for key and its version, calling loader() to populate it on a miss.
+
+        Parameters:
+        - key (hashable): Cache key, e.g. (variable, agg_method, agg_period, days).
+        - loader (callable): Zero-argument function producing the value. Only one caller per key runs it at a time;
+          concurrent callers for the same key block until it finishes and share its result, unless a stale value
+          can be served instead.
+
+        Returns:
+        - tuple: (value, version), read together so a concurrent put can't pair one value with another's version.
+          Use the version for ETags and for keys derived from the value.
+        """
+
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._fresh(entry[1]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], entry[2]
+
+                event = self._in_flight.get(key)
+                if entry is not None and self._usable(entry[1]):
+                    # Serve the stale value, and start reloading it in the background unless that's under way
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if event is None:
+                        event = threading.Event()
+                        self._in_flight[key] = event
+                        threading.Thread(target=self._revalidate, args=(key, loader, event),
+                                         name='cache-revalidate', daemon=True).start()
+                    return entry[0], entry[2]
+
+                if event is None:
+                    # This caller becomes the leader for the key
+                    event = threading.Event()
+                    self._in_flight[key] = event
+                    self.misses += 1
+                    break
+                self.coalesced += 1
+
+            # Another thread is already loading this key, wait for it and re-check the cache
+            event.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry[0], entry[2]
+            # The leader failed without ever storing a value, loop round and try to load it ourselves
+
+        return self._load(key, loader, event)
+
+    def _load(self, key, loader, event):
+        try:
+            value = loader()
+            return value, self.put(key, value)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+
+    def _revalidate(self, key, loader, event):
+        try:
+            self._load(key, loader, event)
+        except Exception as e:
+            # Keep serving the stale value, the next request past its ttl tries again
+            with self._lock:
+                self.refresh_errors += 1
+            print(f"Background refresh of {key} failed: {e}")
+
+    def version(self, key):
+        """
+        Returns a number that changes every time key is stored, or None if key isn't cached. Used for ETags.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[2] if entry is not None else None
+
+    def invalidate(self, key=None):
+        """
+        Drops a single key, or every entry if key is None.
+        """
+
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """
+        Returns a dictionary of cache counters for sizing the cache.
+        """
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            # Deep memory of the cached frames, categoricals make this cheap to measure
+            cached_bytes = sum(int(entry[0].memory_usage(index=False, deep=True).sum())
+                               for entry in self._entries.values() if hasattr(entry[0], 'memory_usage'))
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'stale_ttl_seconds': self.stale_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'stale_hits': self.stale_hits,
+                'refresh_errors': self.refresh_errors,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'bytes': cached_bytes,
+            }
+
+
+# Shared by every AggData instance in the process. Windows up to six hours past their ttl are served while they
+# are refreshed, so dashboard polls don't hold a server thread for an upstream round trip
+data_cache = DataCache(stale_ttl=6 * 60 * 60)
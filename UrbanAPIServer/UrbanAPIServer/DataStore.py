@@ -0,0 +1,206 @@
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the server runs as a single process anyway
+    fcntl = None
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from Frames import concat_frames
+
+
+class DataStore:
+    """
+    Local columnar store of fetched sensor data, partitioned into one Parquet file per series per day.
+
+    Layout: {root}/{variable}/{agg_method}_{agg_period}/{YYYY-MM-DD}.parquet, plus a coverage.json recording the
+    contiguous time range the files cover. Columns keep their dtypes, so 'Timestamp' comes back as datetimes.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def series_dir(self, series_key):
+        variable, agg_method, agg_period = series_key
+        return self.root / variable.replace(os.sep, '_') / f"{agg_method}_{agg_period}"
+
+    def day_path(self, series_key, day):
+        return self.series_dir(series_key) / f"{day.isoformat()}.parquet"
+
+    @contextmanager
+    def lock(self, name, blocking=True):
+        """
+        Holds an exclusive lock shared by every process using this store, e.g. the workers of a multi-process server.
+
+        Parameters:
+        - name (str): Lock file name relative to the store root, e.g. 'PM2.5/median_15mins/.lock'.
+        - blocking (bool, optional): Wait for the lock. If False, yields False straight away when another process
+          holds it. Defaults to True.
+
+        Yields:
+        - bool: True if the lock is held. Always True where file locks aren't available.
+        """
+
+        if fcntl is None:
+            yield True
+            return
+
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def series_lock(self, series_key):
+        """
+        Cross-process lock for one series, held while fetching and writing it so workers don't duplicate requests.
+        """
+
+        return self.lock(str((self.series_dir(series_key) / '.lock').relative_to(self.root)))
+
+    def coverage(self, series_key):
+        """
+        Returns the (start, end) datetimes covered by the stored files, or None if nothing is stored.
+        """
+
+        path = self.series_dir(series_key) / "coverage.json"
+        if not path.exists():
+            return None
+        with open(path) as f:
+            coverage = json.load(f)
+        return datetime.fromisoformat(coverage['start']), datetime.fromisoformat(coverage['end'])
+
+    def _set_coverage(self, series_key, start, end):
+        path = self.series_dir(series_key) / "coverage.json"
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'start': start.isoformat(), 'end': end.isoformat()}, f)
+        os.replace(tmp_path, path)
+
+    def modified(self, name):
+        """
+        Returns a number that changes whenever the file name, relative to the store root, is replaced, or None if
+        it doesn't exist. Lets a process keep a parsed copy until another process writes a new one.
+        """
+
+        try:
+            return os.stat(self.root / name).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def read_json(self, name):
+        """
+        Returns the object stored by write_json under name, or None if there isn't one.
+        """
+
+        try:
+            with open(self.root / name) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def write_json(self, name, obj):
+        """
+        Stores a JSON-serialisable object under name, relative to the store root, for every process using the store.
+
+        Parameters:
+        - name (str): File name, e.g. 'forecasts/jobs.json'.
+        - obj (object): The object to store.
+
+        Returns:
+        - None
+        """
+
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Replaced in one step, so readers in other processes never see a half-written file
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+
+    def write(self, series_key, df, start, end):
+        """
+        Merges fetched rows into the day partitions they fall in and extends the recorded coverage.
+
+        Parameters:
+        - series_key (tuple): (variable, agg_method, agg_period) identifying the series.
+        - df (DataFrame): Fetched rows with a datetime 'Timestamp' column.
+        - start (datetime): Start of the range that was requested from the API.
+        - end (datetime): End of the range that was requested from the API.
+
+        Returns:
+        - None
+        """
+
+        if df.empty or 'Timestamp' not in df:
+            return
+
+        self.series_dir(series_key).mkdir(parents=True, exist_ok=True)
+
+        for day, day_df in df.groupby(df['Timestamp'].dt.date):
+            path = self.day_path(series_key, day)
+            if path.exists():
+                day_df = concat_frames([pq.read_table(path).to_pandas(), day_df])
+                day_df = day_df.drop_duplicates(subset=['Sensor Name', 'Timestamp'], keep='last')
+            day_df = day_df.sort_values('Timestamp')
+
+            # Write to a temporary file first so readers never see a half-written partition
+            tmp_path = path.with_suffix('.tmp')
+            pq.write_table(pa.Table.from_pandas(day_df, preserve_index=False), tmp_path)
+            os.replace(tmp_path, path)
+
+        # Extend the coverage if the new range touches it, otherwise start again from the new range
+        coverage = self.coverage(series_key)
+        if coverage is not None and start <= coverage[1] and end >= coverage[0]:
+            start, end = min(start, coverage[0]), max(end, coverage[1])
+        self._set_coverage(series_key, start, end)
+
+    def read(self, series_key, start, end=None, columns=None):
+        """
+        Reads stored rows between start and end, only opening the day partitions in range.
+
+        Parameters:
+        - series_key (tuple): (variable, agg_method, agg_period) identifying the series.
+        - start (datetime): Earliest timestamp to return.
+        - end (datetime, optional): Latest timestamp to return. Defaults to None, meaning no upper bound.
+        - columns (list, optional): Columns to read. Defaults to None, meaning all columns.
+
+        Returns:
+        - DataFrame: The matching rows, empty if nothing is stored for the range.
+        """
+
+        end_day = (end or datetime.now()).date()
+        filters = [('Timestamp', '>=', pd.Timestamp(start))]
+        if end is not None:
+            filters.append(('Timestamp', '<=', pd.Timestamp(end)))
+
+        tables = []
+        day = start.date()
+        while day <= end_day:
+            path = self.day_path(series_key, day)
+            if path.exists():
+                # Memory-mapped read with the column projection and timestamp filter pushed into the reader
+                tables.append(pq.read_table(path, columns=columns, filters=filters, memory_map=True))
+            day += timedelta(days=1)
+
+        if not tables:
+            return pd.DataFrame()
+        return pa.concat_tables(tables, promote_options='default').to_pandas().reset_index(drop=True)
+
+
+data_store = DataStore(os.environ.get('URBAN_DATA_STORE', 'data_store'))
@@ -0,0 +1,126 @@
+import numpy as np
+
+
+def lttb_indices(x, y, points):
+    """
+    Picks the points of a series that best preserve its visual shape, using Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The rest of the series is split into points - 2 equal buckets and
+    from each the point forming the largest triangle with the previously kept point and the mean of the next bucket
+    is kept.
+
+    Parameters:
+    - x (ndarray): Sorted x values, e.g. timestamps as integers.
+    - y (ndarray): y values, the same length as x.
+    - points (int): Number of points to keep.
+
+    Returns:
+    - ndarray: Sorted indices of the kept points.
+    """
+
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n) if points >= n else np.linspace(0, n - 1, max(points, 0), dtype=int)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket edges over the points between the first and the last
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+
+    kept = np.empty(points, dtype=int)
+    kept[0] = 0
+    kept[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Mean of the next bucket, or the last point for the final bucket
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        # Twice the triangle area, for every candidate in the bucket at once
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        kept[i + 1] = a
+    return kept
+
+
+def min_max_indices(x, y, points):
+    """
+    Keeps the minimum and maximum of each of points // 2 equal-width x buckets, so peaks and troughs survive.
+
+    Parameters:
+    - x (ndarray): Sorted x values.
+    - y (ndarray): y values, the same length as x.
+    - points (int): Most points to keep.
+
+    Returns:
+    - ndarray: Sorted indices of the kept points.
+    """
+
+    n = len(x)
+    buckets = points // 2
+    if points >= n or buckets < 1:
+        return np.arange(n) if points >= n else np.arange(min(n, 1))
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    span = x[-1] - x[0]
+    bucket = np.zeros(n, dtype=int) if span == 0 else np.minimum(((x - x[0]) / span * buckets).astype(int),
+                                                                  buckets - 1)
+
+    # Sort by (bucket, y), then the first and last row of each bucket are its minimum and maximum
+    order = np.lexsort((y, bucket))
+    sorted_buckets = bucket[order]
+    first = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    last = np.r_[first[1:] - 1, n - 1]
+    return np.unique(np.concatenate([order[first], order[last]]))
+
+
+DECIMATION_METHODS = {
+    'lttb': lttb_indices,
+    'minmax': min_max_indices,
+}
+
+
+def decimate(df, points, method='lttb', group='Sensor Name', x='Timestamp', y='Value'):
+    """
+    Thins every group of a frame to about points rows, keeping the rows that matter most to a chart.
+
+    Parameters:
+    - df (DataFrame): Rows to thin, with group, x and y columns.
+    - points (int): Target number of rows per group, e.g. the chart's width in pixels.
+    - method (str, optional): 'lttb' for Largest-Triangle-Three-Buckets, or 'minmax' for the extremes of each
+      bucket. Defaults to 'lttb'.
+    - group (str, optional): Column identifying a series. Defaults to 'Sensor Name'.
+    - x (str, optional): Column to order each series by. Defaults to 'Timestamp'.
+    - y (str, optional): Column whose shape is preserved. Defaults to 'Value'.
+
+    Returns:
+    - DataFrame: The kept rows, in their original order with a fresh index.
+
+    Raises:
+    - ValueError: If method isn't one of DECIMATION_METHODS, or points is less than 3.
+    """
+
+    if method not in DECIMATION_METHODS:
+        raise ValueError(f"Unknown decimation method: {method}")
+    if points < 3:
+        raise ValueError("points must be at least 3")
+    if df.empty or group not in df:
+        return df
+
+    select = DECIMATION_METHODS[method]
+    df_sorted = df.sort_values([group, x], kind='stable')
+    x_values = df_sorted[x].to_numpy()
+    if np.issubdtype(x_values.dtype, np.datetime64):
+        x_values = x_values.astype('datetime64[ns]').astype(np.int64)
+    y_values = df_sorted[y].to_numpy(dtype=float)
+
+    # Positions of each series within the sorted frame
+    codes = df_sorted.groupby(group, observed=True, sort=False).ngroup().to_numpy()
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+
+    kept = [start + select(x_values[start:end], y_values[start:end], points) for start, end in zip(starts, ends)]
+    positions = np.concatenate(kept) if kept else np.array([], dtype=int)
+    return df_sorted.iloc[positions].sort_index().reset_index(drop=True)
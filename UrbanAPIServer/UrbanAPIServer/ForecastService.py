@@ -0,0 +1,363 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from AggData import AggData
+from DataStore import data_store
+
+# How many finished jobs and fits to remember for status lookups and reporting
+MAX_JOBS = 200
+MAX_FIT_HISTORY = 500
+
+# Sensors with fewer cleaned-up rows than this are skipped by batch runs
+MIN_SENSOR_ROWS = 48
+
+# Fields of a per-sensor result kept in the batch state and served. The models are stored apart, see model_name
+SENSOR_FIELDS = ('forecast', 'mae', 'fitted_at')
+
+# A job or batch run still marked running after this long is taken to have died with its worker process
+RUN_TIMEOUT = timedelta(minutes=30)
+
+# Forecast state in the data store, shared by every server worker process
+FORECASTS_DIR = 'forecasts'
+JOBS_FILE = f"{FORECASTS_DIR}/jobs.json"
+HISTORY_FILE = f"{FORECASTS_DIR}/history.json"
+
+
+def state_name(key, kind):
+    """
+    Returns the store file name holding one kind of forecast state, e.g. 'result.json', for a (variable, days,
+    backend) key.
+    """
+
+    variable, days, backend = key
+    return f"{FORECASTS_DIR}/{variable.replace(os.sep, '_')}_{days}d_{backend}.{kind}"
+
+
+def model_name(key, sensor):
+    """
+    Returns the store file name holding a sensor's serialized model from the latest batch run for a (variable, days,
+    backend) key.
+    """
+
+    variable, days, backend = key
+    return (f"{FORECASTS_DIR}/models/{variable.replace(os.sep, '_')}_{days}d_{backend}/"
+            f"{sensor.replace(os.sep, '_')}.json")
+
+
+def timed_out(started):
+    return datetime.now() - datetime.fromisoformat(started) >= RUN_TIMEOUT
+
+
+class ForecastService:
+    """
+    Runs Prophet fits in a process pool so HTTP requests never wait on Stan.
+
+    Fitted forecasts are cached per (variable, days) together with the newest timestamp in the data they were
+    fitted on. A cached forecast is reused until enough new data has arrived (min_new_fraction of the rows it was
+    fitted on) or it is older than the staleness budget (max_staleness). Refits are warm started from the previous
+    model's parameters. While a refit is running the previous forecast keeps being served, and concurrent requests
+    for the same (variable, days) share one job.
+
+    Results, jobs and batch runs are kept as JSON in the data store rather than in memory, so under a multi-process
+    server any worker can answer for a job another one started, and a key being fitted by one worker isn't fitted
+    again by the others.
+    """
+
+    def __init__(self, max_workers=None, min_new_fraction=0.02, max_staleness=timedelta(hours=1), warm_start=True,
+                 batch_interval=timedelta(hours=1), default_backend='prophet', backends=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # Forecasting backend per variable, see Forecasting.FORECAST_BACKENDS
+        self.default_backend = default_backend
+        self.backends = dict(backends or {})
+        self.min_new_fraction = min_new_fraction
+        self.max_staleness = max_staleness
+        self.warm_start = warm_start
+        self.executor = None
+        self.batch_interval = batch_interval
+        # Store file name -> (modified, parsed contents), so large results are only parsed again once rewritten
+        self.parsed = {}
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        if self.executor is None:
+            # Spawn rather than fork, the API server has threads running
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def _read(self, name):
+        modified = data_store.modified(name)
+        with self.lock:
+            parsed = self.parsed.get(name)
+            if parsed is not None and parsed[0] == modified:
+                return parsed[1]
+        value = data_store.read_json(name) if modified is not None else None
+        with self.lock:
+            self.parsed[name] = (modified, value)
+        return value
+
+    def _update_job(self, job):
+        # Jobs of every worker live in one bounded file, oldest first
+        with data_store.lock(f"{FORECASTS_DIR}/jobs.lock"):
+            jobs = OrderedDict(data_store.read_json(JOBS_FILE) or {})
+            jobs[job['job_id']] = job
+            while len(jobs) > MAX_JOBS:
+                jobs.popitem(last=False)
+            data_store.write_json(JOBS_FILE, jobs)
+
+    def backend_for(self, variable, backend=None):
+        from Forecasting import FORECAST_BACKENDS
+
+        backend = backend or self.backends.get(variable, self.default_backend)
+        if backend not in FORECAST_BACKENDS:
+            raise ValueError(f"Unknown forecasting backend: {backend}")
+        return backend
+
+    def is_stale(self, result, df):
+        """
+        Returns True if the data has moved far enough past a cached result to be worth refitting.
+        """
+
+        if df.empty or result['data_end'] is None:
+            return result['data_end'] is not None
+        if datetime.now() - datetime.fromisoformat(result['fitted_at']) >= self.max_staleness:
+            return True
+        new_rows = int((df['Timestamp'] > pd.Timestamp(result['data_end'])).sum())
+        return new_rows >= self.min_new_fraction * max(result['rows'], 1)
+
+    def get(self, variable, days, backend=None):
+        """
+        Returns the cached forecast for (variable, days), starting a refit if the data has moved on.
+
+        Parameters:
+        - variable (str): Data variable to forecast.
+        - days (int): Window of data to fit on.
+        - backend (str, optional): Forecasting backend to use. Defaults to None, the variable's configured backend.
+
+        Returns:
+        - tuple: (result, job). result is the latest finished forecast dict, or None if there isn't one yet.
+          job is the status dict of a fit started or already running for newer data, or None if result is current.
+        """
+
+        key = (variable, days, self.backend_for(variable, backend))
+        data_instance = AggData(variable, days, register=False)
+        data_end = data_instance.df['Timestamp'].max().isoformat() if not data_instance.df.empty else None
+
+        def current(result):
+            return result is not None and (result['data_end'] == data_end
+                                           or not self.is_stale(result, data_instance.df))
+
+        result = self._read(state_name(key, 'result.json'))
+        if current(result):
+            return result, None
+
+        # Held across workers while checking for a running fit, so only one of them submits one
+        with data_store.lock(state_name(key, 'lock')):
+            # Another worker may have stored a newer fit while we waited
+            result = self._read(state_name(key, 'result.json'))
+            if current(result):
+                return result, None
+            job = data_store.read_json(state_name(key, 'job.json'))
+            if job is None or job['status'] != 'running' or timed_out(job['submitted']):
+                previous_model = result['model'] if result is not None and self.warm_start else None
+                job = self._submit(key, data_instance.df, data_end, previous_model)
+        return result, job
+
+    def _submit(self, key, df, data_end, previous_model=None):
+        # Called with the key's store lock held. Imported on first use, Prophet is slow to import
+        from Forecasting import forecast_job
+
+        job_id = uuid.uuid4().hex
+        job = {
+            'job_id': job_id,
+            'variable': key[0],
+            'days': key[1],
+            'backend': key[2],
+            'status': 'running',
+            'submitted': datetime.now().isoformat(),
+            'finished': None,
+            'error': None,
+        }
+        self._update_job(job)
+        data_store.write_json(state_name(key, 'job.json'), job)
+
+        future = self._executor().submit(forecast_job, df, previous_model, False, key[2])
+        future.add_done_callback(lambda f: self._finish(key, dict(job), data_end, f))
+        return job
+
+    def _finish(self, key, job, data_end, future):
+        job['finished'] = datetime.now().isoformat()
+        try:
+            result = future.result()
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        else:
+            result.update(data_end=data_end, fitted_at=job['finished'], job_id=job['job_id'])
+            data_store.write_json(state_name(key, 'result.json'), result)
+            job['status'] = 'finished'
+            job.update(fit_seconds=result['fit_seconds'], warm_start=result['warm_start'], mae=result['mae'])
+            self._record_fit({
+                'variable': key[0],
+                'days': key[1],
+                'backend': key[2],
+                'finished': job['finished'],
+                'rows': result['rows'],
+                'warm_start': result['warm_start'],
+                'fit_seconds': result['fit_seconds'],
+                'mae': result['mae'],
+            })
+        self._update_job(job)
+        data_store.write_json(state_name(key, 'job.json'), job)
+
+    def _record_fit(self, fit):
+        with data_store.lock(f"{FORECASTS_DIR}/history.lock"):
+            history = data_store.read_json(HISTORY_FILE) or []
+            data_store.write_json(HISTORY_FILE, (history + [fit])[-MAX_FIT_HISTORY:])
+
+    def job_status(self, job_id):
+        jobs = self._read(JOBS_FILE) or {}
+        job = jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    def forecast_sensors(self, variable, days, backend=None):
+        """
+        Fits a separate forecast for every sensor of a variable across the process pool.
+
+        Series are sent to the pool as workers free up, with at most two per worker in flight, so only a bounded
+        number of per-sensor frames are pickled and held at once. Each sensor's previous model is used to warm
+        start its refit. Each sensor's model is stored in a file of its own, so the results stored with the run
+        status hold only the forecast horizon and stay cheap to parse on every request.
+
+        Parameters:
+        - variable (str): Data variable to forecast.
+        - days (int): Window of data to fit on.
+        - backend (str, optional): Forecasting backend to use. Defaults to None, the variable's configured backend.
+
+        Returns:
+        - dict: Run status including the number of series fitted, failures and throughput in series per minute.
+        """
+
+        from Forecasting import forecast_job
+
+        key = (variable, days, self.backend_for(variable, backend))
+        name = state_name(key, 'sensors.json')
+        run = {'variable': variable, 'days': days, 'backend': key[2], 'status': 'running',
+               'started': datetime.now().isoformat(), 'finished': None, 'series': 0, 'failed': 0, 'skipped': 0,
+               'series_per_minute': None}
+        previous = {sensor: {field: result[field] for field in SENSOR_FIELDS}
+                    for sensor, result in (self._read(name) or {}).get('sensors', {}).items()}
+        data_store.write_json(name, {'run': run, 'sensors': previous})
+
+        start = time.perf_counter()
+        results = {}
+        in_flight = {}
+        max_in_flight = 2 * self.max_workers
+
+        def collect(done):
+            for future in done:
+                sensor = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception:
+                    run['failed'] += 1
+                    continue
+                data_store.write_json(model_name(key, sensor), result.pop('model'))
+                result['fitted_at'] = datetime.now().isoformat()
+                results[sensor] = result
+                run['series'] += 1
+
+        try:
+            df = AggData(variable, days, register=False).df
+            for sensor, sensor_df in df.groupby('Sensor Name', observed=True):
+                if len(sensor_df) < MIN_SENSOR_ROWS:
+                    run['skipped'] += 1
+                    continue
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                previous_model = data_store.read_json(model_name(key, sensor)) if self.warm_start else None
+                future = self._executor().submit(forecast_job, sensor_df, previous_model, True, key[2])
+                in_flight[future] = sensor
+            collect(wait(in_flight)[0])
+        except Exception as e:
+            run.update(status='failed', finished=datetime.now().isoformat(), error=str(e))
+            data_store.write_json(name, {'run': run, 'sensors': previous})
+            print(f"Sensor forecast batch for {variable} failed: {e}")
+            return dict(run)
+
+        elapsed = time.perf_counter() - start
+        run.update(status='finished', finished=datetime.now().isoformat(), seconds=elapsed,
+                   series_per_minute=run['series'] / elapsed * 60 if elapsed else None)
+        data_store.write_json(name, {'run': run, 'sensors': results})
+        throughput = f"{run['series_per_minute']:.1f}" if run['series_per_minute'] is not None else 'n/a'
+        print(f"Forecast {run['series']} {variable} sensors in {elapsed:.1f}s ({throughput} series/minute)")
+        return dict(run)
+
+    def batch_is_current(self, run):
+        """
+        Returns True if a batch run is still going, or finished less than batch_interval ago.
+        """
+
+        if run['status'] == 'running':
+            return not timed_out(run['started'])
+        return datetime.now() - datetime.fromisoformat(run['finished']) < self.batch_interval
+
+    def start_sensor_batch(self, variable, days, backend=None):
+        """
+        Starts forecast_sensors in a background thread, unless a run for (variable, days) is already in progress
+        or finished less than batch_interval ago, in this worker process or another.
+
+        Returns:
+        - dict: Status of the run started or already held for (variable, days).
+        """
+
+        key = (variable, days, self.backend_for(variable, backend))
+        name = state_name(key, 'sensors.json')
+        with data_store.lock(state_name(key, 'lock')):
+            state = data_store.read_json(name) or {}
+            run = state.get('run')
+            if run is not None and self.batch_is_current(run):
+                return dict(run)
+            # Placeholder so a second caller doesn't start a duplicate run before the thread registers
+            run = {'variable': variable, 'days': days, 'backend': key[2], 'status': 'running',
+                   'started': datetime.now().isoformat(), 'finished': None}
+            data_store.write_json(name, dict(state, run=run))
+
+        threading.Thread(target=self.forecast_sensors, args=key, name='sensor-forecasts',
+                         daemon=True).start()
+        return dict(run)
+
+    def sensor_forecasts(self, variable, days, backend=None):
+        """
+        Returns the latest per-sensor forecasts and batch run status for (variable, days).
+        """
+
+        key = (variable, days, self.backend_for(variable, backend))
+        state = self._read(state_name(key, 'sensors.json')) or {}
+        run = state.get('run')
+        return {
+            'run': dict(run) if run is not None else None,
+            'sensors': {sensor: {field: result[field] for field in SENSOR_FIELDS}
+                        for sensor, result in state.get('sensors', {}).items()},
+        }
+
+    def history(self):
+        """
+        Returns fit time and MAE for recent fits, for comparing warm-started refits against cold fits.
+        """
+
+        return list(self._read(HISTORY_FILE) or [])
+
+
+# Each server worker process gets its own pool, so size it with URBAN_FORECAST_WORKERS when running several
+forecast_service = ForecastService(max_workers=int(os.environ.get('URBAN_FORECAST_WORKERS', 0)) or None,
+                                   default_backend=os.environ.get('URBAN_FORECAST_BACKEND', 'prophet'))
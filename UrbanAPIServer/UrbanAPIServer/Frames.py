@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+
+def concat_frames(frames):
+    """
+    Concatenates DataFrames, keeping categorical columns categorical.
+
+    pd.concat falls back to object dtype when categorical columns have different categories, which is the
+    normal case for chunks parsed separately, so the categories are unioned before concatenating.
+
+    Parameters:
+    - frames (list): DataFrames with the same columns.
+
+    Returns:
+    - DataFrame: The concatenated frame with a fresh index.
+    """
+
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+
+    # Give every frame the same categories up front, so pd.concat keeps the columns categorical
+    frames = [frame.copy(deep=False) for frame in frames]
+    for column in frames[0].columns:
+        if not all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames):
+            continue
+        categories = frames[0][column].cat.categories
+        for frame in frames[1:]:
+            categories = categories.union(frame[column].cat.categories)
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+
+    return pd.concat(frames, ignore_index=True)
+
+
+# Column types of the compact time-series frames held in memory, see SensorRegistry.compact
+FRAME_SCHEMA = {
+    'Sensor ID': 'int32',
+    'Variable': 'category',
+    'Units': 'category',
+    'Value': 'float32',
+    'Flagged as Suspect Reading': 'bool',
+}
+
+# Spellings of the suspect flag seen in CSVs, for when it isn't parsed as a boolean
+FLAG_VALUES = {True: True, False: False, 'True': True, 'False': False, 'true': True, 'false': False}
+
+
+def enforce_schema(df, schema=FRAME_SCHEMA):
+    """
+    Converts a frame's columns to the compact types in schema.
+
+    Columns outside the schema are narrowed by kind: strings become categoricals and floats become float32.
+    Boolean columns with missing values become the nullable 'boolean' type, so the missing values survive for
+    dropna rather than turning into True.
+
+    Parameters:
+    - df (DataFrame): Frame to convert.
+    - schema (dict, optional): Column name to dtype. Defaults to FRAME_SCHEMA.
+
+    Returns:
+    - DataFrame: The frame with converted columns, or df itself if nothing needed converting.
+    """
+
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        dtype = schema.get(column)
+        if dtype is None:
+            if series.dtype == object:
+                dtype = 'category'
+            elif pd.api.types.is_float_dtype(series.dtype):
+                dtype = 'float32'
+            else:
+                continue
+        elif dtype == 'bool':
+            if series.dtype == object:
+                series = series.map(FLAG_VALUES)
+            if series.isna().any():
+                dtype = 'boolean'
+
+        if series.dtype != dtype:
+            columns[column] = series.astype(dtype)
+        elif series is not df[column]:
+            columns[column] = series
+
+    return df.assign(**columns) if columns else df
+
+
+def widen_floats(df):
+    """
+    Converts float32 columns to float64 through their shortest decimal form, for text formats such as JSON.
+
+    Converting directly keeps the float32 rounding error, so 9.172 would be written as 9.1719999313. NumPy prints
+    float32 values with the fewest digits that read back to the same float32, and parsing those digits as float64
+    gives the value the API sent.
+
+    Parameters:
+    - df (DataFrame): Frame to convert. It is not modified.
+
+    Returns:
+    - DataFrame: The frame with float64 columns in place of float32 ones, or df itself if it has none.
+    """
+
+    columns = {column: df[column].to_numpy().astype(str).astype(np.float64)
+               for column in df.columns if df[column].dtype == np.float32}
+    return df.assign(**columns) if columns else df
@@ -187,16 +187,18 @@ def plot_choropleth(gdf):
     Plots a choropleth map using GeoDataFrame data, showing spatial distribution of values.
 
     Parameters:
-    - gdf (GeoDataFrame): A GeoDataFrame with a 'Value' column to plot and geometries set in EPSG:4326 coordinate reference system.
+    - gdf (GeoDataFrame): A GeoDataFrame with a 'Value' column to plot. Geometries without a CRS are taken to be in EPSG:4326.
 
     Returns:
     - None: Displays the choropleth map in a matplotlib figure with a basemap from contextily.
     """
 
     merged_gdf = gdf
-    # Set CRS for the merged GeoDataFrame
-    merged_gdf = merged_gdf.set_crs("EPSG:4326")
-    merged_gdf = merged_gdf.to_crs("EPSG:3857")
+    # Set CRS for the merged GeoDataFrame, and only reproject if it isn't in Web Mercator already
+    if merged_gdf.crs is None:
+        merged_gdf = merged_gdf.set_crs("EPSG:4326")
+    if merged_gdf.crs != "EPSG:3857":
+        merged_gdf = merged_gdf.to_crs("EPSG:3857")
 
     # Plot the choropleth map
     fig, ax = plt.subplots(figsize=(10, 10))
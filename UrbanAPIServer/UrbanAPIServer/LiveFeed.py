@@ -0,0 +1,208 @@
+import json
+import queue
+import threading
+import time
+
+from AggData import AGG_PERIOD_DELTAS
+from DataStore import data_store
+
+
+def sse_message(data, event=None, event_id=None):
+    """
+    Encodes a Server-Sent Events message.
+
+    Parameters:
+    - data (object): JSON-serialisable payload.
+    - event (str, optional): Event type for the client's addEventListener. Defaults to None, a 'message' event.
+    - event_id (str, optional): Id the browser sends back as Last-Event-ID when it reconnects. Defaults to None.
+
+    Returns:
+    - str: The message, ending with the blank line that dispatches it.
+    """
+
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+
+def format_end(end):
+    return end.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+class Subscription:
+    """
+    One client's stream of update notices for a set of variables. Encoded messages wait in a bounded queue until the
+    client reads them.
+    """
+
+    def __init__(self, variables, max_queue):
+        self.variables = frozenset(variables)
+        self.events = queue.Queue(maxsize=max_queue)
+        # Set when the client fell too far behind and should reload everything instead
+        self.overflowed = False
+
+    def push(self, message):
+        try:
+            self.events.put_nowait(message)
+        except queue.Full:
+            self.overflowed = True
+
+    def next_message(self, timeout):
+        """
+        Returns the next message, or None if nothing arrived within timeout seconds.
+        """
+
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LiveFeed:
+    """
+    Tells subscribed clients when new aggregation buckets of a variable have been stored, e.g. over Server-Sent Events.
+
+    A single watcher thread per process checks the coverage of each subscribed variable's series in the shared
+    store every poll_interval seconds. When it has grown, one small 'updated' notice is encoded and queued for every
+    subscriber of the variable, and clients re-request the views they show. Clients' views are downsampled or
+    aggregated on the server, so a notice is all they need, and the work per update doesn't grow with the number of
+    clients. Watching the store rather than the fetch path means subscribers of any server worker hear about rows
+    fetched by whichever worker runs the prefetcher.
+    """
+
+    def __init__(self, agg_method='median', agg_period='15mins', poll_interval=15, max_queue=64):
+        self.agg_method = agg_method
+        self.agg_period = agg_period
+        self.poll_interval = poll_interval
+        self.max_queue = max_queue
+        self.subscribers = {}  # variable -> set of Subscriptions
+        self.cursors = {}  # variable -> end of the stored data at the last update
+        self.notices = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def series_key(self, variable):
+        return variable, self.agg_method, self.agg_period
+
+    def stored_end(self, variable):
+        """
+        Returns the end of the stored data for variable, or None if nothing is stored.
+        """
+
+        coverage = data_store.coverage(self.series_key(variable))
+        return coverage[1] if coverage is not None else None
+
+    def subscribe(self, variables):
+        """
+        Registers a client for update notices of several variables, starting the watcher thread if needed.
+
+        Parameters:
+        - variables (list): Data variables to follow, e.g. ['PM2.5', 'NO2'].
+
+        Returns:
+        - Subscription: Pass to unsubscribe when the client goes away.
+        """
+
+        subscription = Subscription(variables, self.max_queue)
+        with self._lock:
+            for variable in subscription.variables:
+                if variable not in self.subscribers:
+                    self.subscribers[variable] = set()
+                    # Only data stored from now on is new to the first subscriber
+                    self.cursors[variable] = self.stored_end(variable)
+                self.subscribers[variable].add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='live-feed', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for variable in subscription.variables:
+                subscribers = self.subscribers.get(variable)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[variable]
+                    del self.cursors[variable]
+
+    def notice(self, variable, end):
+        """
+        Encodes the 'updated' message for new data of variable stored up to end. Its id is end, which a
+        reconnecting client sends back so missed updates can be re-sent.
+        """
+
+        return sse_message({'variable': variable, 'end': format_end(end)}, event='updated', event_id=format_end(end))
+
+    def missed(self, variables, since):
+        """
+        Returns the 'updated' messages for the variables whose stored data has grown past since, for a reconnecting
+        client.
+
+        The client's last id is the newest notice it saw, and a variable fetched just before that may not have been
+        announced yet, so anything stored within an aggregation period of it is re-sent.
+        """
+
+        since -= AGG_PERIOD_DELTAS[self.agg_period]
+        ends = [(self.stored_end(variable), variable) for variable in variables]
+        # Oldest first, so the id the browser keeps afterwards is the newest
+        return [self.notice(variable, end) for end, variable in sorted(end for end in ends if end[0] is not None)
+                if end > since]
+
+    def update(self, variable):
+        """
+        Notifies the subscribers of variable if its stored data has grown since the last update. Called by the
+        watcher thread.
+
+        Returns:
+        - bool: Whether a notice was sent.
+        """
+
+        end = self.stored_end(variable)
+        with self._lock:
+            if variable not in self.cursors:
+                return False
+            cursor = self.cursors[variable]
+            if end is None or (cursor is not None and end <= cursor):
+                return False
+            self.cursors[variable] = end
+            subscribers = list(self.subscribers[variable])
+
+        # Encoded once, however many clients follow the variable
+        message = self.notice(variable, end)
+        for subscription in subscribers:
+            subscription.push(message)
+        self.notices += 1
+        return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                variables = list(self.subscribers)
+                if not variables:
+                    # Nobody is listening, the next subscriber starts a new watcher
+                    self._thread = None
+                    return
+            for variable in variables:
+                try:
+                    self.update(variable)
+                except Exception as e:
+                    print(f"Live feed update for {variable} failed: {e}")
+            time.sleep(self.poll_interval)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'variables': {variable: len(subscribers) for variable, subscribers in self.subscribers.items()},
+                'subscribers': len(set().union(*self.subscribers.values())) if self.subscribers else 0,
+                'notices': self.notices,
+                'running': self._thread is not None and self._thread.is_alive(),
+            }
+
+
+live_feed = LiveFeed()
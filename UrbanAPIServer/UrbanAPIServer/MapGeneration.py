@@ -1,3 +1,67 @@
+import numpy as np
+
+from SensorRegistry import web_mercator, web_mercator_inverse
+
+
+def spike_coordinates(lon, lat, lengths):
+    """
+    Computes the base and tip of an upward spike for every sensor at once.
+
+    Parameters:
+    - lon (array-like): Sensor longitudes in degrees.
+    - lat (array-like): Sensor latitudes in degrees.
+    - lengths (array-like): Spike lengths in Web Mercator metres.
+
+    Returns:
+    - tuple: (base_x, base_y, tip_x, tip_y) NumPy arrays in EPSG:3857.
+    """
+
+    base_x, base_y = web_mercator(lon, lat)
+    # Spikes point straight up, so only the northing changes
+    return base_x, base_y, base_x, base_y + np.asarray(lengths, dtype=float)
+
+
+def spike_feature_collection(lon, lat, values, lengths):
+    """
+    Builds a GeoJSON FeatureCollection of upward spikes, one per sensor, without any per-row geometry objects.
+
+    Parameters:
+    - lon (array-like): Sensor longitudes in degrees.
+    - lat (array-like): Sensor latitudes in degrees.
+    - values (array-like): Values stored on each feature's 'Value' property.
+    - lengths (array-like): Spike lengths in Web Mercator metres.
+
+    Returns:
+    - dict: A GeoJSON FeatureCollection of LineStrings in WGS84, each with 'Value' and 'TopCoords' properties.
+    """
+
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    _, _, tip_x, tip_y = spike_coordinates(lon, lat, lengths)
+    # One batched transform for every tip back to WGS84
+    tip_lon, tip_lat = web_mercator_inverse(tip_x, tip_y)
+
+    features = [
+        {
+            "type": "Feature",
+            "properties": {
+                "Value": value,
+                "TopCoords": [top_lon, top_lat]  # Include the top coordinates in the properties
+            },
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [
+                    [base_lon, base_lat],  # Start of the line (base of the spike)
+                    [top_lon, top_lat]  # End of the line (tip of the spike)
+                ]
+            }
+        }
+        for value, base_lon, base_lat, top_lon, top_lat in zip(np.asarray(values, dtype=float).tolist(),
+                                                               lon.tolist(), lat.tolist(),
+                                                               tip_lon.tolist(), tip_lat.tolist())
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
 
 def plot_sensor_spikes(df, scale_factor=100):
     """
@@ -11,42 +75,28 @@ def plot_sensor_spikes(df, scale_factor=100):
     - None: Displays a plot with spikes indicating sensor data values at different locations.
     """
 
-    scale_factor = scale_factor * 10
-    # Convert the DataFrame to a GeoDataFrame
-    gdf = gpd.GeoDataFrame(df,
-                           geometry=gpd.points_from_xy(df['Sensor Centroid Longitude'], df['Sensor Centroid Latitude']))
-
-    # Set CRS for the GeoDataFrame
-    gdf = gdf.set_crs("EPSG:4326")
-    gdf = gdf.to_crs("EPSG:3857")
-
-    # Set all angles to 0 degrees (up)
-    gdf['angle'] = 0
+    # Imported here so the spike builders can be used without the plotting stack
+    import contextily as ctx
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
+    import shapely
 
-    # Create the create_spike function as before, but set the angle to 0 degrees (up)
-    def create_spike(row, scale_factor):
-        centroid = row.geometry.centroid
-
-        # Apply the log transformation to the 'Value' column
-        # Use np.log1p to compute the natural logarithm of one plus the input array, element-wise
-        # This function provides greater precision for small input values
-        spike_length = np.log1p(row['Value']) * scale_factor
-
-        angle = 0  # Set the angle to 0 degrees (up)
+    scale_factor = scale_factor * 10
 
-        end_y = centroid.y + spike_length * np.cos(np.deg2rad(angle))
-        end_x = centroid.x + spike_length * np.sin(np.deg2rad(angle))
-        spike_line = LineString([(centroid.x, centroid.y), (end_x, end_y)])
+    # Apply the log transformation to the 'Value' column
+    # Use np.log1p to compute the natural logarithm of one plus the input array, element-wise
+    # This function provides greater precision for small input values
+    spike_lengths = np.log1p(df['Value'].to_numpy(dtype=float)) * scale_factor
 
-        return spike_line
+    base_x, base_y, tip_x, tip_y = spike_coordinates(df['Sensor Centroid Longitude'], df['Sensor Centroid Latitude'],
+                                                     spike_lengths)
 
-    # Create a copy of the GeoDataFrame and apply the create_spike function
-    gdf_spikes = gdf.copy()
-    gdf_spikes['geometry'] = gdf.apply(create_spike, scale_factor=scale_factor, axis=1)
+    # Build every spike LineString in one call from an (n, 2, 2) array of base and tip coordinates
+    coords = np.stack([np.column_stack([base_x, base_y]), np.column_stack([tip_x, tip_y])], axis=1)
+    gdf_spikes = gpd.GeoDataFrame(df, geometry=shapely.linestrings(coords), crs="EPSG:3857")
 
     # Plot the spikes on the map
     fig, ax = plt.subplots(figsize=(10, 10))
-    # gdf.geometry.plot(ax=ax, markersize=10, color='blue')  # Sensor locations dots
     gdf_spikes.plot(ax=ax, linewidth=2, color='#FF7518')
     plt.axis('equal')  # Set equal aspect ratio
 
@@ -57,64 +107,12 @@ def plot_sensor_spikes(df, scale_factor=100):
     plt.show()
 
 
-import folium
-from joblib import Parallel, delayed
-from scipy.stats.mstats import winsorize
-from branca.colormap import linear
-import geopandas as gpd
-from shapely.geometry import LineString
-import numpy as np
-
-
-def create_folium_spike(row, scale_factor):
-    """
-    Creates a GeoJSON feature representing a spike for a single sensor reading. For use by folium map generator.
-
-    Parameters:
-    - row (Series): A pandas Series that must include 'Value' and 'geometry' representing the sensor's location.
-    - scale_factor (float): Scaling factor to adjust the length of the spike.
-
-    Returns:
-    - dict: A GeoJSON dictionary representing the spike from the sensor's location upward.
-    """
-
-    centroid = row.geometry.centroid
-    spike_length = row['Value'] * scale_factor
-    angle = 0  # Set the angle to 0 degrees (up)
-
-    end_y = centroid.y + spike_length * np.cos(np.deg2rad(angle))
-    end_x = centroid.x + spike_length * np.sin(np.deg2rad(angle))
-    spike_line = LineString([(centroid.x, centroid.y), (end_x, end_y)])
-
-    # Convert the spike's coordinates from Web Mercator to WGS84
-    spike_wgs84 = gpd.GeoSeries(spike_line, crs="EPSG:3857").to_crs("EPSG:4326").iloc[0]
-
-    # Calculate the coordinates for the top of the spike
-    top_coords = [spike_wgs84.coords[1][0], spike_wgs84.coords[1][1]]
-
-    # Return a GeoJSON Feature for the spike
-    return {
-        "type": "Feature",
-        "properties": {
-            "Value": row["Value"],
-            "TopCoords": top_coords  # Include the top coordinates in the properties
-        },
-        "geometry": {
-            "type": "LineString",
-            "coordinates": [
-                [spike_wgs84.coords[0][0], spike_wgs84.coords[0][1]],  # Start of the line (base of the spike)
-                [spike_wgs84.coords[1][0], spike_wgs84.coords[1][1]]  # End of the line (tip of the spike)
-            ]
-        }
-    }
-
-
 def create_sensor_spike_map_folium(gdf, location=[54.9714, -1.6174], zoom_start=12, scale_factor=100):
     """
     Creates an interactive map using Folium with spikes representing sensor data values.
 
     Parameters:
-    - gdf (GeoDataFrame): GeoDataFrame containing sensor data with a 'Value' column and geometry defined.
+    - gdf (GeoDataFrame): GeoDataFrame containing sensor data with a 'Value' column and point geometry in WGS84.
     - location (list, optional): The initial center for the Folium map in latitude and longitude. Defaults to [54.9714, -1.6174].
     - zoom_start (int, optional): Initial zoom level for the Folium map. Defaults to 12.
     - scale_factor (int, optional): Factor to scale the sensor data values for spike representation. Defaults to 100.
@@ -123,6 +121,10 @@ def create_sensor_spike_map_folium(gdf, location=[54.9714, -1.6174], zoom_start=
     - folium.Map: A Folium Map object with spikes representing sensor data values.
     """
 
+    import folium
+    from branca.colormap import linear
+    from scipy.stats.mstats import winsorize
+
     # Create an empty Folium Map object centered at Newcastle upon Tyne
     m = folium.Map(
         location=location,
@@ -134,33 +136,23 @@ def create_sensor_spike_map_folium(gdf, location=[54.9714, -1.6174], zoom_start=
         fill_color='rgba(0, 0, 0, 0.2)'
     )
 
-    # Set CRS for the GeoDataFrame
-    gdf = gdf.set_crs("EPSG:4326", allow_override=True)
-    gdf = gdf.to_crs("EPSG:3857")
-
     # Filter out rows with missing values
     gdf_filtered = gdf.dropna(subset=['Value'])
 
     # Winsorize the 'Value' column
-    gdf_filtered['Value'] = winsorize(gdf_filtered['Value'], limits=[0.05, 0.05])
-
-    gdf_filtered['geometry'] = gdf.geometry.buffer(0.001)
+    values = np.asarray(winsorize(gdf_filtered['Value'].to_numpy(dtype=float), limits=[0.05, 0.05]))
 
     # Create a colormap for the 'Value' column
-    colormap = linear.Oranges_09.scale(gdf_filtered['Value'].min(), gdf_filtered['Value'].max())
+    colormap = linear.Oranges_09.scale(values.min(), values.max())
     colormap.caption = 'Values'  # Set the legend label here
 
-    # Parallelize the spike creation
-    n_jobs = -1  # Use all available cores
-    spikes = Parallel(n_jobs=n_jobs) \
-        (delayed(create_folium_spike)(row, scale_factor) for index, row in gdf_filtered.iterrows())
+    # Build every spike at once from the sensor coordinates
+    spikes = spike_feature_collection(gdf_filtered.geometry.x, gdf_filtered.geometry.y, values,
+                                      values * scale_factor)
 
     # Add the spikes to the map as GeoJSON
     folium.GeoJson(
-        data={
-            "type": "FeatureCollection",
-            "features": spikes
-        },
+        data=spikes,
         style_function=lambda feature: {
             "color": colormap(feature["properties"]["Value"]),
             "weight": 2.5,
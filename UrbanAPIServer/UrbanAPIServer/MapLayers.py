@@ -0,0 +1,127 @@
+import gzip
+import json
+import math
+
+from AggData import AggData
+from DataCache import DataCache
+from Frames import widen_floats
+from RemoveOutliers import clean
+from SensorRegistry import sensor_registry
+
+# Serialized layers per (variable, days, version, tile). The data version is part of the key, so a refresh simply
+# makes new entries and the old ones age out
+layer_cache = DataCache(max_entries=256, ttl=60 * 60)
+
+# Tiles are only useful down to street level, anything deeper is served from the zoom 18 tile containing it
+MAX_TILE_ZOOM = 18
+
+
+def sensor_max_values(df):
+    """
+    Reduces readings to the maximum non-suspect value seen at each sensor.
+
+    Parameters:
+    - df (DataFrame): Readings with 'Sensor ID' and 'Value' columns.
+
+    Returns:
+    - DataFrame: One row per sensor with its registry entry and maximum 'Value'.
+    """
+
+    df = clean(df)
+    df_max = df.groupby('Sensor ID')['Value'].max()
+    # Names and coordinates come from the registry rather than being grouped on
+    return sensor_registry.frame(df_max.index).assign(Value=df_max.to_numpy())
+
+
+def cached_sensor_max_values(data_instance):
+    """
+    Returns sensor_max_values for an AggData instance, computed once per version of its data.
+
+    Parameters:
+    - data_instance (AggData): Instance whose window to reduce.
+
+    Returns:
+    - DataFrame: One row per sensor with its registry entry and maximum 'Value'. Shared, don't modify it.
+    """
+
+    key = ('sensor_max',) + data_instance.cache_key() + (data_instance.version,)
+    return layer_cache.get_or_load(key, lambda: sensor_max_values(data_instance.df))[0]
+
+
+def tile_bounds(z, x, y):
+    """
+    Returns the WGS84 bounds of a slippy map tile.
+
+    Parameters:
+    - z (int): Zoom level.
+    - x (int): Tile column.
+    - y (int): Tile row, counted from the north.
+
+    Returns:
+    - tuple: (west, south, east, north) in degrees.
+    """
+
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def feature_collection(df_max):
+    """
+    Builds a GeoJSON FeatureCollection of sensor points with their maximum value.
+
+    Spike lengths and bubble radii are left to the client, so changing the scale never needs a new layer.
+    """
+
+    # Values are float32 in memory, write them as the API sent them
+    df_max = widen_floats(df_max)
+    features = [
+        {
+            "type": "Feature",
+            "properties": {"Sensor Name": sensor, "Value": value},
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        }
+        for sensor, lat, lon, value in zip(df_max['Sensor Name'].astype(str).tolist(),
+                                           df_max['Sensor Centroid Latitude'].tolist(),
+                                           df_max['Sensor Centroid Longitude'].tolist(),
+                                           df_max['Value'].tolist())
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+
+def sensor_max_layer(variable, days, tile=None):
+    """
+    Returns the per-sensor maximum value layer for a variable, serialized and compressed ahead of time.
+
+    Parameters:
+    - variable (str): Data variable of the layer.
+    - days (int): Window length in days.
+    - tile (tuple, optional): (z, x, y) to return only the sensors inside that tile. Defaults to None, every sensor.
+
+    Returns:
+    - dict: 'version' of the data the layer was built from, 'json' and 'gzip' bodies as bytes.
+    """
+
+    data_instance = AggData(variable, days, register=False)
+    if tile is not None:
+        z, x, y = tile
+        if z > MAX_TILE_ZOOM:
+            shift = z - MAX_TILE_ZOOM
+            tile = (MAX_TILE_ZOOM, x >> shift, y >> shift)
+
+    def build():
+        df_max = cached_sensor_max_values(data_instance)
+        if tile is not None:
+            west, south, east, north = tile_bounds(*tile)
+            lon = df_max['Sensor Centroid Longitude'].to_numpy()
+            lat = df_max['Sensor Centroid Latitude'].to_numpy()
+            # Tiles own their west and north edges, so a sensor on an edge is in exactly one tile
+            df_max = df_max[(lon >= west) & (lon < east) & (lat > south) & (lat <= north)]
+        body = json.dumps(feature_collection(df_max), separators=(',', ':')).encode()
+        return {'version': data_instance.version, 'json': body, 'gzip': gzip.compress(body, compresslevel=6)}
+
+    key = ('layer', variable, days, data_instance.version, tile)
+    return layer_cache.get_or_load(key, build)[0]
@@ -0,0 +1,132 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+from AggData import AggData, VARIABLES, DAY_OPTIONS, AGG_PERIOD_DELTAS
+from DataStore import data_store
+from UpstreamClient import upstream, UpstreamMaintenance
+
+
+class PrefetchScheduler:
+    """
+    Background thread that keeps the hot set of (variable, days) windows warm in the shared cache.
+
+    Refreshes run just after each upstream aggregation period closes, so user requests are served from memory
+    rather than waiting on the Urban Observatory API. While the API shows its maintenance page the scheduler
+    backs off exponentially instead of retrying every period.
+
+    Under a multi-process server every worker calls start(leader_lock=...), and only the process holding the lock
+    runs the refreshes. The others wait on the lock and take over if that process exits.
+    """
+
+    def __init__(self, variables=VARIABLES, day_options=DAY_OPTIONS, period=AGG_PERIOD_DELTAS['15mins'],
+                 delay=timedelta(minutes=2), max_backoff=timedelta(hours=1)):
+        self.variables = list(variables)
+        # Longest window first, so shorter windows only need the stored series trimming
+        self.day_options = sorted(day_options, reverse=True)
+        self.period = period
+        self.delay = delay
+        self.max_backoff = max_backoff
+        self.backoff = None
+        self.last_refresh = None
+        self.last_error = None
+        # Callables run after each successful refresh, e.g. to kick off scheduled forecasts
+        self.hooks = []
+        # Whether this process is the one running refreshes
+        self.leader = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def next_run(self, now):
+        """
+        Returns the next time to refresh: the end of the current aggregation period plus the upstream delay.
+        """
+
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        periods = (now - midnight) // self.period + 1
+        return midnight + periods * self.period + self.delay
+
+    def refresh_variable(self, variable):
+        for days in self.day_options:
+            AggData.refresh(variable, days)
+
+    def run_once(self):
+        """
+        Refreshes every window in the hot set, fetching the variables concurrently.
+
+        Raises:
+        - UpstreamMaintenance: If the API is down for maintenance.
+        """
+
+        upstream.map(self.refresh_variable, self.variables)
+        self.last_refresh = datetime.now()
+        for hook in self.hooks:
+            hook()
+
+    def _run_as_leader(self, leader_lock, retry):
+        while not self._stop.is_set():
+            with data_store.lock(leader_lock, blocking=False) as leader:
+                if leader:
+                    self.leader = True
+                    print(f"Process {os.getpid()} is running the prefetcher")
+                    self._run()
+                    return
+            self._stop.wait(retry.total_seconds())
+
+    def _run(self):
+        wait = 0
+        while not self._stop.wait(wait):
+            try:
+                self.run_once()
+                self.backoff = None
+                self.last_error = None
+                wait = (self.next_run(datetime.now()) - datetime.now()).total_seconds()
+            except UpstreamMaintenance as e:
+                self.backoff = min(self.max_backoff, self.backoff * 2) if self.backoff else self.period
+                self.last_error = str(e)
+                print(f"Upstream under maintenance, retrying prefetch in {self.backoff}")
+                wait = self.backoff.total_seconds()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Prefetch failed: {e}")
+                wait = (self.next_run(datetime.now()) - datetime.now()).total_seconds()
+
+    def start(self, leader_lock=None, retry=timedelta(minutes=1)):
+        """
+        Starts refreshing in a background thread.
+
+        Parameters:
+        - leader_lock (str, optional): Store lock name to elect one process out of several to run the refreshes.
+          Defaults to None, always run.
+        - retry (timedelta, optional): How often a process without the lock checks whether it is free. Defaults to
+          one minute.
+
+        Returns:
+        - None
+        """
+
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            if leader_lock is None:
+                self.leader = True
+                self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+            else:
+                self._thread = threading.Thread(target=self._run_as_leader, args=(leader_lock, retry),
+                                                name='prefetch', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'leader': self.leader,
+            'pid': os.getpid(),
+            'last_refresh': self.last_refresh.isoformat() if self.last_refresh else None,
+            'backoff_seconds': self.backoff.total_seconds() if self.backoff else None,
+            'last_error': self.last_error,
+        }
+
+
+prefetcher = PrefetchScheduler()
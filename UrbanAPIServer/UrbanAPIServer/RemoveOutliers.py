@@ -1,24 +1,118 @@
-def Remove_Suspect(df):
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from DataCache import DataCache
+
+# Cleaned views per (window, data version, options), shared by every request for the same data
+clean_cache = DataCache(max_entries=64, ttl=15 * 60)
+
+
+def suspect_mask(df):
     """
-    Cleans a DataFrame by removing suspect or invalid data.
+    Builds a boolean mask of the rows that are not suspect or invalid, without copying or modifying df.
 
     Parameters:
-    - df (DataFrame): The DataFrame to clean, which must include the columns 'Value' and 'Flagged as Suspect Reading'.
+    - df (DataFrame): The DataFrame to check, which must include the columns 'Value' and 'Flagged as Suspect Reading'.
+
+    Returns:
+    - ndarray: True for rows with no NaN values, a 'Value' above 0 and no suspect flag.
+    """
+
+    valid = ~df.isna().any(axis=1).to_numpy()
+    valid &= (df['Value'] > 0).to_numpy(dtype=bool, na_value=False)
+    valid &= (df['Flagged as Suspect Reading'] == False).to_numpy(dtype=bool, na_value=False)
+    return valid
+
+
+def iqr_mask(df, valid=None, per_sensor=False):
+    """
+    Builds a boolean mask of the rows whose 'Value' is within 1.5 IQR of the quartiles, without copying df.
+
+    Parameters:
+    - df (DataFrame): DataFrame with a 'Value' column.
+    - valid (ndarray, optional): Rows to compute the quartiles from, e.g. suspect_mask(df). Defaults to None, every
+      row with a 'Value'.
+    - per_sensor (bool, optional): Compute the quartiles for each sensor separately. Defaults to False.
 
     Returns:
-    - DataFrame: A cleaned DataFrame with NaN values and suspect readings removed.
+    - ndarray: True for non-outlier rows.
     """
 
-    # Drop rows containing NaN values
-    df.dropna(inplace=True)
+    values = df['Value'].to_numpy(dtype=float, na_value=np.nan)
+    if valid is None:
+        valid = ~np.isnan(values)
+    if not valid.any():
+        return np.zeros(len(values), dtype=bool)
 
-    # Remove rows with 'Value' <= 0
-    df = df[df['Value'] > 0]
+    if per_sensor:
+        sensors = df['Sensor ID' if 'Sensor ID' in df else 'Sensor Name']
+        # Both quartiles of every sensor in one call, then looked up for each row
+        quartiles = df['Value'][valid].groupby(sensors[valid], observed=True).quantile([0.25, 0.75]).unstack()
+        q1 = quartiles[0.25].reindex(sensors).to_numpy(dtype=float)
+        q3 = quartiles[0.75].reindex(sensors).to_numpy(dtype=float)
+    else:
+        q1, q3 = np.quantile(values[valid], [0.25, 0.75])
 
-    # Remove flagged as suspect readings
-    df = df[df['Flagged as Suspect Reading'] == False]
+    iqr = q3 - q1
+    return (values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)
 
-    return df
+
+def clean(df, remove_outliers=False, per_sensor=False):
+    """
+    Removes suspect readings, and optionally outliers, with a single combined mask and one copy.
+
+    Parameters:
+    - df (DataFrame): The DataFrame to clean. It is not modified.
+    - remove_outliers (bool or str, optional): True to also remove outliers by the IQR method, or 'online' to remove
+      the rows flagged in the 'Outlier' column at ingestion. Defaults to False.
+    - per_sensor (bool, optional): Compute the IQR for each sensor separately. Defaults to False.
+
+    Returns:
+    - DataFrame: The cleaned rows.
+    """
+
+    mask = suspect_mask(df)
+    if remove_outliers == 'online':
+        if 'Outlier' in df:
+            mask &= ~df['Outlier'].to_numpy(dtype=bool)
+    elif remove_outliers:
+        mask &= iqr_mask(df, mask, per_sensor)
+    return df[mask]
+
+
+def cached_clean(data_instance, remove_outliers=False, per_sensor=False):
+    """
+    Returns clean(data_instance.df, ...), computed once per version of the data and set of options.
+
+    Parameters:
+    - data_instance (AggData): Instance whose window to clean.
+    - remove_outliers (bool or str, optional): True for the IQR method or 'online', see clean. Defaults to False.
+    - per_sensor (bool, optional): Compute the IQR for each sensor separately. Defaults to False.
+
+    Returns:
+    - DataFrame: The cleaned rows. Shared between callers, don't modify it.
+    """
+
+    key = data_instance.cache_key() + (data_instance.version, remove_outliers, bool(per_sensor))
+    return clean_cache.get_or_load(key, lambda: clean(data_instance.df, remove_outliers, per_sensor))[0]
+
+
+def Remove_Suspect(df):
+    """
+    Cleans a DataFrame by removing suspect or invalid data.
+
+    Parameters:
+    - df (DataFrame): The DataFrame to clean, which must include the columns 'Value' and 'Flagged as Suspect Reading'.
+
+    Returns:
+    - DataFrame: A cleaned DataFrame with NaN values and suspect readings removed. df itself is not modified.
+    """
+
+    return clean(df)
 
 
 def Remove_Outlier_Indices(df):
@@ -32,26 +126,215 @@ def Remove_Outlier_Indices(df):
     - DataFrame: A boolean DataFrame where True indicates non-outlier data points.
     """
 
-    Q1 = df.quantile(0.25)
-    Q3 = df.quantile(0.75)
+    quartiles = df.quantile([0.25, 0.75])
+    Q1, Q3 = quartiles.iloc[0], quartiles.iloc[1]
     IQR = Q3 - Q1
     trueList = ~((df < (Q1 - 1.5 * IQR)) | (df > (Q3 + 1.5 * IQR)))
     return trueList
 
 
-def iqr_method(df):
+def iqr_method(df, per_sensor=False):
     """
     Filters a DataFrame to remove outliers using the Interquartile Range (IQR) method.
 
     Parameters:
     - df (DataFrame): The DataFrame from which outliers are to be removed. It must include a 'Value' column.
+    - per_sensor (bool, optional): Compute the IQR for each sensor separately. Defaults to False.
 
     Returns:
     - DataFrame: A DataFrame containing only the non-outlier entries from the original DataFrame.
     """
 
-    nonOutliers = Remove_Outlier_Indices(df['Value'])
-
     # Non-Outlier Subset of the Given Dataset
-    dfIQR = df[nonOutliers]
-    return dfIQR
+    return df[iqr_mask(df, per_sensor=per_sensor)]
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch with relative accuracy, in the style of DDSketch.
+
+    Positive values are counted in logarithmically sized buckets, so any quantile is returned within
+    relative_accuracy of the true value whatever the distribution. Two sketches with the same accuracy merge exactly
+    by adding bucket counts. Values of 0 or below are only counted, suspect filtering removes them anyway.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}  # Bucket index -> count
+        self.zero_count = 0
+        self.count = 0
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+        if len(positive):
+            keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                self.buckets[key] = self.buckets.get(key, 0) + count
+
+    def merge(self, other):
+        """
+        Adds another sketch's counts into this one. Both must have the same relative accuracy.
+        """
+
+        if other.gamma != self.gamma:
+            raise ValueError("Can only merge sketches with the same relative accuracy")
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantiles(self, qs):
+        """
+        Estimates several quantiles in one walk over the buckets.
+
+        Parameters:
+        - qs (list): Quantiles between 0 and 1, in ascending order.
+
+        Returns:
+        - list: The estimated values, or None for each if the sketch is empty.
+        """
+
+        if not self.count:
+            return [None] * len(qs)
+
+        keys = sorted(self.buckets)
+        cumulative = np.cumsum([self.buckets[key] for key in keys]) + self.zero_count
+        results = []
+        for q in qs:
+            rank = q * (self.count - 1)
+            if rank < self.zero_count:
+                results.append(0.0)
+                continue
+            key = keys[int(np.searchsorted(cumulative, rank, side='right'))]
+            # Midpoint of the bucket, within relative_accuracy of every value in it
+            results.append(2 * self.gamma ** key / (self.gamma + 1))
+        return results
+
+
+class OnlineOutlierFilter:
+    """
+    Per-sensor IQR fences kept up to date from streaming quantile sketches, so new readings are classified as they
+    arrive rather than by re-running iqr_method over the whole window.
+
+    Each sensor has one sketch per day, and its fences come from the merge of the last window_days sketches, so old
+    days drop out without keeping the raw values. Fences are recomputed at most once per update of a sensor, after
+    which classifying a reading is a comparison against two cached numbers.
+    """
+
+    def __init__(self, window_days=7, relative_accuracy=0.01, min_count=20):
+        self.window_days = window_days
+        self.relative_accuracy = relative_accuracy
+        # Sensors with fewer readings than this in the window have no fences yet, nothing is flagged
+        self.min_count = min_count
+        self.sketches = {}  # (variable, sensor) -> OrderedDict of day -> QuantileSketch
+        self.covered = {}  # (variable, sensor) -> (first, last) Timestamps of the readings added so far
+        self.fences = {}  # (variable, sensor) -> (low, high), dropped when the sensor's sketches change
+        self.lock = threading.Lock()
+
+    def observe(self, variable, df):
+        """
+        Adds the valid readings of df outside the span already seen for each sensor to its daily sketches, so a
+        longer window fetched later adds its older days as well as any newer ones.
+
+        Parameters:
+        - variable (str): Data variable of the readings.
+        - df (DataFrame): Rows with 'Sensor ID', 'Timestamp', 'Value' and the columns suspect_mask needs.
+
+        Returns:
+        - None
+        """
+
+        if df.empty or 'Sensor ID' not in df or 'Timestamp' not in df:
+            return
+
+        df = df[suspect_mask(df)]
+        with self.lock:
+            for (sensor, day), day_df in df.groupby(['Sensor ID', df['Timestamp'].dt.date], observed=True):
+                key = (variable, sensor)
+                # Readings inside the covered span, e.g. a re-fetched bucket, were counted when they first arrived
+                covered = self.covered.get(key)
+                if covered is not None:
+                    day_df = day_df[(day_df['Timestamp'] < covered[0]) | (day_df['Timestamp'] > covered[1])]
+                if day_df.empty:
+                    continue
+
+                days = self.sketches.setdefault(key, OrderedDict())
+                days.setdefault(day, QuantileSketch(self.relative_accuracy)).add_many(day_df['Value'].to_numpy())
+                self.fences.pop(key, None)
+
+            spans = df.groupby('Sensor ID', observed=True)['Timestamp'].agg(['min', 'max'])
+            for sensor, first, last in zip(spans.index, spans['min'], spans['max']):
+                key = (variable, sensor)
+                covered = self.covered.get(key, (first, last))
+                self.covered[key] = (min(first, covered[0]), max(last, covered[1]))
+                # Drop days that have left the window, and keep the sketches' days in order after adding older ones
+                newest = self.covered[key][1].date()
+                days = self.sketches.get(key, OrderedDict())
+                kept = OrderedDict((day, days[day]) for day in sorted(days) if (newest - day).days < self.window_days)
+                if list(kept) != list(days):
+                    self.sketches[key] = kept
+                    self.fences.pop(key, None)
+
+    def _fences(self, key):
+        # Called with self.lock held
+        if key not in self.fences:
+            merged = QuantileSketch(self.relative_accuracy)
+            for sketch in self.sketches.get(key, {}).values():
+                merged.merge(sketch)
+            if merged.count < self.min_count:
+                self.fences[key] = (-np.inf, np.inf)
+            else:
+                q1, q3 = merged.quantiles([0.25, 0.75])
+                self.fences[key] = (q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1))
+        return self.fences[key]
+
+    def is_outlier(self, variable, sensor, value):
+        """
+        Classifies a single reading against its sensor's current fences.
+        """
+
+        with self.lock:
+            low, high = self._fences((variable, sensor))
+        return not low <= value <= high
+
+    def flag(self, variable, df):
+        """
+        Adds a boolean 'Outlier' column to df, True for readings outside their sensor's current fences.
+
+        Parameters:
+        - variable (str): Data variable of the readings.
+        - df (DataFrame): Rows with 'Sensor ID' and 'Value'.
+
+        Returns:
+        - DataFrame: A new frame with the 'Outlier' column, or df unchanged if it has no 'Sensor ID'.
+        """
+
+        if 'Sensor ID' not in df:
+            return df
+
+        sensors = df['Sensor ID'].to_numpy()
+        unique, inverse = np.unique(sensors, return_inverse=True)
+        with self.lock:
+            fences = np.array([self._fences((variable, sensor)) for sensor in unique.tolist()]).reshape(-1, 2)
+        values = df['Value'].to_numpy(dtype=float, na_value=np.nan)
+        low, high = fences[inverse, 0], fences[inverse, 1]
+        return df.assign(Outlier=pd.Series((values < low) | (values > high), index=df.index))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'sensors': len(self.sketches),
+                'sketches': sum(len(days) for days in self.sketches.values()),
+                'buckets': sum(len(sketch.buckets) for days in self.sketches.values() for sketch in days.values()),
+            }
+
+
+# Fed by AggData as data is fetched
+online_outliers = OnlineOutlierFilter()
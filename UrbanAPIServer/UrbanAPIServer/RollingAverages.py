@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+class RollingAverage:
+    """
+    Running mean of a variable over a trailing time window, maintained one aggregation bucket at a time.
+
+    Each bucket keeps the sum and count of its readings. Adding a bucket that is already held replaces it, so a
+    re-fetched bucket whose median changed is counted once. Buckets older than the window are dropped as newer
+    ones arrive, and reading the mean is O(1).
+    """
+
+    def __init__(self, window=timedelta(hours=24)):
+        self.window = window
+        self.buckets = OrderedDict()  # Timestamp -> (sum, count), oldest first
+        self.total = 0.0
+        self.count = 0
+        self.last_update = None
+
+    def add_bucket(self, timestamp, total, count):
+        old = self.buckets.pop(timestamp, None)
+        if old is not None:
+            self.total -= old[0]
+            self.count -= old[1]
+        if self.buckets and timestamp < next(reversed(self.buckets)):
+            # Late bucket, re-sort so eviction from the front stays oldest first
+            self.buckets[timestamp] = (total, count)
+            self.buckets = OrderedDict(sorted(self.buckets.items()))
+        else:
+            self.buckets[timestamp] = (total, count)
+        self.total += total
+        self.count += count
+
+        # Drop buckets that have left the window
+        newest = next(reversed(self.buckets))
+        while self.buckets:
+            oldest, (old_total, old_count) = next(iter(self.buckets.items()))
+            if oldest > newest - self.window:
+                break
+            del self.buckets[oldest]
+            self.total -= old_total
+            self.count -= old_count
+
+    def update(self, df):
+        """
+        Adds the 'Value' readings in df, grouped into buckets by 'Timestamp'.
+
+        Parameters:
+        - df (DataFrame): Rows with 'Timestamp' and 'Value' columns, typically a freshly fetched tail.
+
+        Returns:
+        - None
+        """
+
+        if df.empty or 'Timestamp' not in df or 'Value' not in df:
+            return
+
+        # Only the buckets that can still be inside the window matter
+        df = df[df['Timestamp'] > df['Timestamp'].max() - self.window]
+        buckets = df.groupby('Timestamp')['Value'].agg(['sum', 'count'])
+        for timestamp, row in buckets.iterrows():
+            self.add_bucket(timestamp, float(row['sum']), int(row['count']))
+        self.last_update = datetime.now()
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class RollingAverages:
+    """
+    Registry of RollingAverage instances, one per variable.
+    """
+
+    def __init__(self, window=timedelta(hours=24)):
+        self.window = window
+        self.averages = {}
+        self.lock = threading.Lock()
+
+    def update(self, variable, df):
+        with self.lock:
+            average = self.averages.setdefault(variable, RollingAverage(self.window))
+            average.update(df)
+
+    def get(self, variable):
+        """
+        Returns the current mean and last update time for variable, without touching the upstream API.
+
+        Returns:
+        - tuple: (mean, last_update), with both None if nothing has been seen for the variable yet.
+        """
+
+        with self.lock:
+            average = self.averages.get(variable)
+            if average is None:
+                return None, None
+            return average.mean(), average.last_update
+
+
+rolling_averages = RollingAverages()
@@ -0,0 +1,253 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from Frames import enforce_schema
+
+# Radius of the sphere used by Web Mercator (EPSG:3857), in metres
+EARTH_RADIUS = 6378137.0
+
+LON_COLUMN = 'Sensor Centroid Longitude'
+LAT_COLUMN = 'Sensor Centroid Latitude'
+
+
+def web_mercator(lon, lat):
+    """
+    Projects WGS84 longitudes and latitudes (EPSG:4326) to Web Mercator (EPSG:3857), element-wise.
+
+    Parameters:
+    - lon (array-like): Longitudes in degrees.
+    - lat (array-like): Latitudes in degrees.
+
+    Returns:
+    - tuple: (x, y) NumPy arrays in metres.
+    """
+
+    x = EARTH_RADIUS * np.radians(np.asarray(lon, dtype=float))
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(np.asarray(lat, dtype=float)) / 2))
+    return x, y
+
+
+def web_mercator_inverse(x, y):
+    """
+    Projects Web Mercator (EPSG:3857) coordinates back to WGS84 longitudes and latitudes, element-wise.
+
+    Parameters:
+    - x (array-like): Eastings in metres.
+    - y (array-like): Northings in metres.
+
+    Returns:
+    - tuple: (lon, lat) NumPy arrays in degrees.
+    """
+
+    lon = np.degrees(np.asarray(x, dtype=float) / EARTH_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp(np.asarray(y, dtype=float) / EARTH_RADIUS)) - np.pi / 2)
+    return lon, lat
+
+
+class SensorRegistry:
+    """
+    Every sensor seen in fetched data, stored once with a small integer id.
+
+    Time-series frames held in memory carry only a 'Sensor ID' column, and the name and centroid columns are looked
+    up here when a frame is handed out. Coordinates are kept in both WGS84 and Web Mercator, and a KD-tree over the
+    Mercator coordinates answers nearest-sensor and bounding-box queries. Ids are assigned in order of first sight
+    and are only stable for the life of the process.
+    """
+
+    def __init__(self):
+        self.ids = {}  # Sensor name -> id
+        self.names = []
+        self.lon = []
+        self.lat = []
+        self._arrays = None
+        self._tree = None
+        self.lock = threading.Lock()
+
+    def _snapshot(self):
+        # Called with self.lock held. Rebuilt only after a sensor is added or moves
+        if self._arrays is None:
+            lon = np.array(self.lon, dtype=float)
+            lat = np.array(self.lat, dtype=float)
+            x, y = web_mercator(lon, lat)
+            self._arrays = dict(names=pd.Index(self.names), lon=lon, lat=lat, x=x, y=y)
+        return self._arrays
+
+    def register(self, df):
+        """
+        Adds any new sensors in df and updates the coordinates of any that have moved.
+
+        Parameters:
+        - df (DataFrame): Rows with 'Sensor Name', 'Sensor Centroid Longitude' and 'Sensor Centroid Latitude'.
+
+        Returns:
+        - ndarray: The int32 sensor id of every row of df.
+        """
+
+        sensors = df[['Sensor Name', LON_COLUMN, LAT_COLUMN]].drop_duplicates('Sensor Name', keep='last')
+        with self.lock:
+            for name, lon, lat in zip(sensors['Sensor Name'].astype(str).tolist(), sensors[LON_COLUMN].tolist(),
+                                      sensors[LAT_COLUMN].tolist()):
+                sensor_id = self.ids.get(name)
+                if sensor_id is None:
+                    self.ids[name] = len(self.names)
+                    self.names.append(name)
+                    self.lon.append(lon)
+                    self.lat.append(lat)
+                elif (self.lon[sensor_id], self.lat[sensor_id]) != (lon, lat):
+                    self.lon[sensor_id], self.lat[sensor_id] = lon, lat
+                else:
+                    continue
+                self._arrays = None
+                self._tree = None
+
+            names = df['Sensor Name']
+            if isinstance(names.dtype, pd.CategoricalDtype):
+                # Look up each category once rather than each row
+                category_ids = np.array([self.ids.get(str(name), -1) for name in names.cat.categories], dtype=np.int32)
+                return np.where(names.cat.codes.to_numpy() >= 0, category_ids[names.cat.codes.to_numpy()], -1)
+            return names.astype(str).map(self.ids).fillna(-1).to_numpy(dtype=np.int32)
+
+    def compact(self, df):
+        """
+        Replaces the name and centroid columns of a time-series frame with an integer 'Sensor ID', and converts the
+        remaining columns to the compact types in Frames.FRAME_SCHEMA.
+
+        Parameters:
+        - df (DataFrame): Fetched rows. Frames without sensor columns, e.g. empty ones, are returned unchanged.
+
+        Returns:
+        - DataFrame: The compact frame.
+        """
+
+        if 'Sensor Name' not in df or LON_COLUMN not in df or LAT_COLUMN not in df:
+            return df
+
+        # Rows without a sensor name can't be placed on a map or attributed, drop them
+        df = df[df['Sensor Name'].notna()]
+        ids = self.register(df)
+        df = df.drop(columns=['Sensor Name', LON_COLUMN, LAT_COLUMN])
+        df.insert(0, 'Sensor ID', ids.astype(np.int32))
+        return enforce_schema(df)
+
+    def expand(self, df):
+        """
+        Adds the 'Sensor Name' and centroid columns back to a compact frame, for code expecting the API's columns.
+
+        Parameters:
+        - df (DataFrame): A frame with a 'Sensor ID' column. Frames without one are returned unchanged.
+
+        Returns:
+        - DataFrame: A new frame with 'Sensor Name' as a categorical and the centroid coordinates in WGS84.
+        """
+
+        if 'Sensor ID' not in df:
+            return df
+
+        with self.lock:
+            arrays = self._snapshot()
+        ids = df['Sensor ID'].to_numpy()
+        df = df.copy()
+        df.insert(0, 'Sensor Name', pd.Categorical.from_codes(ids, categories=arrays['names']))
+        df[LON_COLUMN] = arrays['lon'][ids]
+        df[LAT_COLUMN] = arrays['lat'][ids]
+        return df
+
+    def mercator(self, ids):
+        """
+        Returns the Web Mercator (x, y) coordinates of the given sensor ids as NumPy arrays.
+        """
+
+        with self.lock:
+            arrays = self._snapshot()
+        ids = np.asarray(ids)
+        return arrays['x'][ids], arrays['y'][ids]
+
+    def frame(self, ids=None):
+        """
+        Returns the registry as a DataFrame with one row per sensor.
+
+        Parameters:
+        - ids (array-like, optional): Sensor ids to include, in order. Defaults to None, every sensor.
+
+        Returns:
+        - DataFrame: 'Sensor ID', 'Sensor Name', centroid longitude and latitude, and Mercator 'x' and 'y'.
+        """
+
+        with self.lock:
+            arrays = self._snapshot()
+        ids = np.arange(len(arrays['names'])) if ids is None else np.asarray(ids, dtype=int)
+        return pd.DataFrame({
+            'Sensor ID': ids,
+            'Sensor Name': arrays['names'][ids],
+            LON_COLUMN: arrays['lon'][ids],
+            LAT_COLUMN: arrays['lat'][ids],
+            'x': arrays['x'][ids],
+            'y': arrays['y'][ids],
+        })
+
+    def _spatial_index(self):
+        # Imported on first use, only spatial queries need SciPy
+        from scipy.spatial import cKDTree
+
+        with self.lock:
+            if self._tree is None:
+                arrays = self._snapshot()
+                self._tree = (cKDTree(np.column_stack([arrays['x'], arrays['y']])), arrays)
+            return self._tree
+
+    def nearest(self, lon, lat, k=1):
+        """
+        Finds the sensors closest to a point.
+
+        Parameters:
+        - lon (float): Longitude of the point in degrees.
+        - lat (float): Latitude of the point in degrees.
+        - k (int, optional): Number of sensors to return. Defaults to 1.
+
+        Returns:
+        - DataFrame: Up to k rows from frame(), nearest first, with a 'Distance' column in Mercator metres.
+        """
+
+        tree, arrays = self._spatial_index()
+        k = min(k, len(arrays['names']))
+        if k < 1:
+            return self.frame([]).assign(Distance=[])
+
+        x, y = web_mercator(lon, lat)
+        distances, ids = tree.query([float(x), float(y)], k=k)
+        result = self.frame(np.atleast_1d(ids))
+        result['Distance'] = np.atleast_1d(distances)
+        return result
+
+    def within_bbox(self, west, south, east, north):
+        """
+        Finds the sensors inside a WGS84 bounding box.
+
+        Parameters:
+        - west (float): Minimum longitude.
+        - south (float): Minimum latitude.
+        - east (float): Maximum longitude.
+        - north (float): Maximum latitude.
+
+        Returns:
+        - DataFrame: Rows from frame() for the sensors inside the box, in id order.
+        """
+
+        tree, arrays = self._spatial_index()
+        if not len(arrays['names']):
+            return self.frame([])
+
+        (x0, x1), (y0, y1) = web_mercator([west, east], [south, north])
+        # A Chebyshev ball around the centre covers the box, then trim it to the box's exact edges
+        half_width, half_height = (x1 - x0) / 2, (y1 - y0) / 2
+        candidates = np.array(tree.query_ball_point([x0 + half_width, y0 + half_height],
+                                                    r=max(half_width, half_height), p=np.inf), dtype=int)
+        inside = ((arrays['x'][candidates] >= x0) & (arrays['x'][candidates] <= x1)
+                  & (arrays['y'][candidates] >= y0) & (arrays['y'][candidates] <= y1))
+        return self.frame(np.sort(candidates[inside]))
+
+
+# Shared by every AggData instance in the process
+sensor_registry = SensorRegistry()
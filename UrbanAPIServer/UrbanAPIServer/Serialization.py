@@ -0,0 +1,174 @@
+import gzip
+import json
+
+try:
+    import brotli
+except ImportError:  # Optional, responses fall back to gzip
+    brotli = None
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from Frames import widen_floats
+from SensorRegistry import LON_COLUMN, LAT_COLUMN
+
+JSON_RECORDS = 'application/json'
+JSON_COLUMNAR = 'application/vnd.urban.columnar+json'
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+
+# ?format= names for clients that can't set Accept, e.g. links and EventSource
+FORMATS = {
+    'records': JSON_RECORDS,
+    'columnar': JSON_COLUMNAR,
+    'arrow': ARROW_STREAM,
+}
+
+# Columns describing a sensor rather than a reading, sent once per sensor in the columnar layout
+SENSOR_COLUMNS = ['Sensor Name', LON_COLUMN, LAT_COLUMN]
+
+# Columns internal to a server process, never sent to clients. Sensor ids are assigned per process, so they differ
+# between workers and restarts, and 'Outlier' is only used to filter rows for ?remove_outliers=online
+PRIVATE_COLUMNS = ['Sensor ID', 'Outlier']
+
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+def negotiate_format(accept_mimetypes, requested=None):
+    """
+    Picks the response format from a ?format= parameter or the Accept header.
+
+    Parameters:
+    - accept_mimetypes (MIMEAccept): The request's parsed Accept header.
+    - requested (str, optional): A key of FORMATS, which takes precedence over the header. Defaults to None.
+
+    Returns:
+    - str: The mimetype to respond with. Row records unless the client asked for something else.
+
+    Raises:
+    - ValueError: If requested isn't one of FORMATS.
+    """
+
+    if requested is not None:
+        if requested not in FORMATS:
+            raise ValueError(f"Unknown format: {requested}")
+        return FORMATS[requested]
+    return accept_mimetypes.best_match([JSON_RECORDS, JSON_COLUMNAR, ARROW_STREAM], default=JSON_RECORDS)
+
+
+def negotiate_encoding(accept_encodings):
+    """
+    Returns 'br', 'gzip' or None, the best compression the client accepts that is available here.
+    """
+
+    # Index for the quality, 'gzip;q=0' is a refusal even though 'gzip' in accept_encodings holds
+    if brotli is not None and accept_encodings['br'] > 0:
+        return 'br'
+    if accept_encodings['gzip'] > 0:
+        return 'gzip'
+    return None
+
+
+def column_values(series):
+    """
+    Converts a column to a JSON-ready list: timestamps as epoch milliseconds and missing values as None.
+    """
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        values = series.to_numpy(dtype='datetime64[ms]').astype(np.int64).astype(object)
+        values[series.isna().to_numpy()] = None
+        return values.tolist()
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.astype(object).where(series.notna(), None).tolist()
+    values = series.to_numpy()
+    if values.dtype.kind == 'f' and np.isnan(values).any():
+        return np.where(np.isnan(values), None, values.astype(object)).tolist()
+    return values.tolist()
+
+
+def to_records_json(df):
+    """
+    Serializes df as a JSON array of row objects, the API's original layout.
+    """
+
+    return widen_floats(df).to_json(orient='records', date_format='iso').encode()
+
+
+def to_columnar_json(df):
+    """
+    Serializes df as one JSON array per column, with sensor metadata and constant columns sent once.
+
+    Layout: {'rows': n, 'constants': {column: value}, 'sensors': {column: [...]}, 'columns': {column: [...]}}.
+    'columns' holds a 'sensor' array of indices into the 'sensors' arrays, and 'Timestamp' is in epoch
+    milliseconds.
+
+    Parameters:
+    - df (DataFrame): Rows to serialize, typically with 'Sensor Name', centroid, 'Timestamp' and 'Value' columns.
+
+    Returns:
+    - bytes: The UTF-8 JSON body.
+    """
+
+    df = widen_floats(df)
+    payload = {'rows': len(df), 'constants': {}, 'sensors': {}, 'columns': {}}
+    columns = [column for column in df.columns if column not in SENSOR_COLUMNS]
+
+    if all(column in df for column in SENSOR_COLUMNS):
+        codes, sensors = pd.factorize(df['Sensor Name'])
+        first = pd.Series(np.arange(len(df))).groupby(codes).first().to_numpy()
+        for column in SENSOR_COLUMNS:
+            payload['sensors'][column] = column_values(df[column].iloc[first])
+        payload['columns']['sensor'] = codes.tolist()
+    else:
+        columns = list(df.columns)
+
+    for column in columns:
+        # e.g. 'Variable' and 'Units', the same on every row of a single-variable frame
+        if len(df) and df[column].nunique(dropna=False) == 1:
+            payload['constants'][column] = column_values(df[column].iloc[:1])[0]
+        else:
+            payload['columns'][column] = column_values(df[column])
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def to_arrow_stream(df):
+    """
+    Serializes df as an Apache Arrow IPC stream. Categorical columns become dictionary-encoded, so sensor names
+    and units are sent once.
+    """
+
+    # Drop the pandas metadata, readers other than pandas ignore it
+    table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+SERIALIZERS = {
+    JSON_RECORDS: to_records_json,
+    JSON_COLUMNAR: to_columnar_json,
+    ARROW_STREAM: to_arrow_stream,
+}
+
+
+def serialize(df, mimetype=JSON_RECORDS, encoding=None):
+    """
+    Serializes a frame in a negotiated format, compressing it if the client accepts compression.
+
+    Parameters:
+    - df (DataFrame): Rows to serialize.
+    - mimetype (str, optional): One of the values of FORMATS. Defaults to JSON_RECORDS.
+    - encoding (str, optional): 'br', 'gzip' or None, from negotiate_encoding. Defaults to None.
+
+    Returns:
+    - tuple: (body, encoding), where encoding is None if the body was left uncompressed.
+    """
+
+    body = SERIALIZERS[mimetype](df.drop(columns=PRIVATE_COLUMNS, errors='ignore'))
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    if encoding == 'br':
+        return brotli.compress(body, quality=5), encoding
+    return gzip.compress(body, compresslevel=6), encoding
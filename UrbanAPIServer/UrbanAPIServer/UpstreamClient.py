@@ -0,0 +1,165 @@
+import io
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from Frames import concat_frames
+
+UO_AGG_CSV_URL = 'http://uoweb3.ncl.ac.uk/api/v1.1/sensors/data/agg/csv/'
+MAINTENANCE_PREFIX = "<!doctype html>\n<title>Site Maintenance</title>"
+
+# Column types applied while parsing, so repeated strings are stored once per chunk rather than once per row
+CSV_DTYPES = {
+    'Sensor Name': 'category',
+    'Variable': 'category',
+    'Units': 'category',
+    'Value': 'float64',
+    'Sensor Centroid Longitude': 'float64',
+    'Sensor Centroid Latitude': 'float64',
+}
+CSV_CHUNK_ROWS = 50_000
+HTTP_CHUNK_BYTES = 64 * 1024
+
+
+class UpstreamMaintenance(Exception):
+    """Raised when the Urban Observatory API returns its "Site Maintenance" page instead of data."""
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    Read-only file object over an iterator of byte chunks, so pandas can parse a response body as it arrives.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            self.buffer = next(self.chunks, None)
+            if self.buffer is None:
+                self.buffer = b''
+                return 0
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
+class UpstreamClient:
+    """
+    Pooled client for the Urban Observatory API.
+
+    A single requests.Session keeps connections alive between calls, every request has a timeout, transient
+    failures are retried with jittered exponential backoff, and a thread pool lets callers fetch several
+    variables at once.
+    """
+
+    def __init__(self, url=UO_AGG_CSV_URL, timeout=(5, 60), retries=3, backoff=0.5, max_backoff=8.0, pool_size=16):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='upstream')
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter, so workers retrying after the same outage don't all come back at once
+        time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def get(self, params, stream=False):
+        """
+        Performs a GET against the API, retrying connection errors, timeouts and 5xx responses. Other non-2xx
+        responses are raised straight away, as a retry won't change them.
+
+        Parameters:
+        - params (dict): Query parameters for the request.
+        - stream (bool, optional): If True the body is left unread for the caller to stream. Defaults to False.
+
+        Returns:
+        - requests.Response: The successful response.
+
+        Raises:
+        - requests.HTTPError: If the API answered with a 4xx, or any other non-2xx status besides a 5xx.
+        - requests.RequestException: If every attempt failed.
+        """
+
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.get(self.url, params=params, timeout=self.timeout, stream=stream)
+                if r.status_code >= 500:
+                    r.close()
+                    r.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError):
+                if attempt == self.retries:
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+
+            if not 200 <= r.status_code < 300:
+                # e.g. a 400 for a bad variable name, whose body would otherwise be parsed as CSV
+                r.close()
+                raise requests.HTTPError(f"{r.status_code} response from {r.url}", response=r)
+            return r
+
+    def fetch_csv(self, params):
+        """
+        Fetches an aggregated CSV from the API, parsing the body in chunks as it streams in.
+
+        The body is never held as a single string; each chunk is parsed straight into typed columns
+        ('Timestamp' as datetimes, names and units as categoricals), so peak memory is the parsed frame plus
+        one chunk rather than several copies of the payload.
+
+        Parameters:
+        - params (dict): Query parameters for the aggregated CSV endpoint.
+
+        Returns:
+        - DataFrame: The parsed CSV.
+
+        Raises:
+        - UpstreamMaintenance: If the API is down for maintenance. This is not retried.
+        """
+
+        with self.get(params, stream=True) as r:
+            body = r.iter_content(chunk_size=HTTP_CHUNK_BYTES)
+            first = next(body, b'')
+            if first.startswith(MAINTENANCE_PREFIX.encode()):
+                raise UpstreamMaintenance("Maintenance")
+            if not first:
+                return pd.DataFrame()
+
+            stream = io.BufferedReader(ChunkStream(itertools.chain([first], body)), buffer_size=HTTP_CHUNK_BYTES)
+            chunks = []
+            for chunk in pd.read_csv(stream, dtype=CSV_DTYPES, chunksize=CSV_CHUNK_ROWS):
+                if 'Timestamp' in chunk:
+                    chunk['Timestamp'] = pd.to_datetime(chunk['Timestamp'])
+                chunks.append(chunk)
+            return concat_frames(chunks)
+
+    def map(self, fn, items):
+        """
+        Runs fn over items on the client's thread pool and returns the results in order.
+
+        Exceptions raised by fn are re-raised in the caller.
+        """
+
+        return list(self.executor.map(fn, items))
+
+
+# Shared by every AggData instance in the process. URBAN_UPSTREAM_URL points it at another copy of the endpoint,
+# e.g. a stub for load tests
+upstream = UpstreamClient(os.environ.get('URBAN_UPSTREAM_URL', UO_AGG_CSV_URL))
@@ -5,26 +5,27 @@ import time
 import geopandas as gpd
 import plotly.graph_objects as go
 
-from AggData import AggData
+from AggData import AggData, VARIABLES, DAY_OPTIONS
 from Forecasting import prophet_forecast
 from GraphGeneration import plot_scatter_graph, distribution_plots, plot_choropleth, create_spinner, create_gauge
 from MapGeneration import create_sensor_spike_map_folium, plot_sensor_spikes
-from RemoveOutliers import iqr_method, Remove_Suspect
+from MapLayers import cached_sensor_max_values
+from RemoveOutliers import cached_clean
+from RollingAverages import rolling_averages
+from SensorRegistry import sensor_registry
+
+# Points per sensor drawn by the time-series charts, about the pixel width of a 12 inch figure
+CHART_POINTS = 1200
 
 
 def plot_line_graph_tab(var1, var2, remove_outliers):
     with line_graph_output:
         clear_output(wait=True)
 
-        # Remove suspects and perform IQR if needed
-        if remove_outliers:
-            var1.df_downsampled = iqr_method(Remove_Suspect(var1.df))
-            var2.df_downsampled = iqr_method(Remove_Suspect(var2.df))
-            print("Outliers Removed")
-        else:
-            var1.df_downsampled = Remove_Suspect(var1.df)
-            var2.df_downsampled = Remove_Suspect(var2.df)
-            print("Outliers Included")
+        # Remove suspects and perform IQR if needed, reusing the cleaned view if the data hasn't changed
+        var1.df_downsampled = cached_clean(var1, remove_outliers)
+        var2.df_downsampled = cached_clean(var2, remove_outliers)
+        print("Outliers Removed" if remove_outliers else "Outliers Included")
 
         # Downsample the data
         if not var1.downsampled:
@@ -32,6 +33,10 @@ def plot_line_graph_tab(var1, var2, remove_outliers):
         if not var2.downsampled:
             var2.downsample()
 
+        # No more points per sensor than the figure has pixels across
+        var1.decimate(CHART_POINTS)
+        var2.decimate(CHART_POINTS)
+
         print("Downsampled")
         # Plot the line graphs
         fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 12), sharex=True)
@@ -43,10 +48,7 @@ def plot_line_graph_tab(var1, var2, remove_outliers):
 def plot_kde_plot_tab(var1, remove_outliers):
     with kde_plot_output:
         kde_plot_output.clear_output(wait=True)
-        df1 = Remove_Suspect(var1.df)
-
-        if remove_outliers:
-            df1 = iqr_method(df1)
+        df1 = cached_clean(var1, remove_outliers)
         print("Outliers Removed:" if remove_outliers else "Outliers Included:")
 
 
@@ -54,9 +56,7 @@ def plot_distribution_analysis_tab(var1, remove_outliers):
     with distribution_analysis_output:
         clear_output(wait=True)
 
-        df1 = Remove_Suspect(var1.df)
-        if remove_outliers:
-            df1 = iqr_method(df1)
+        df1 = cached_clean(var1, remove_outliers)
 
         print("Outliers Removed:" if remove_outliers else "Outliers Included:")
 
@@ -68,10 +68,8 @@ def plot_sensor_spike_map_tab(var1, scale_factor):
     # FOLIUM
     with sensor_spike_map_output:
         sensor_spike_map_output.clear_output()
-        df1 = Remove_Suspect(var1.df)
-
-        # Group by 'Sensor Centroid Latitude' and 'Sensor Centroid Longitude', and take the maximum 'Value'
-        df_max = df1.groupby(['Sensor Centroid Latitude', 'Sensor Centroid Longitude'])['Value'].max().reset_index()
+        # Maximum 'Value' per sensor, computed once per version of the data so rescaling only redraws
+        df_max = cached_sensor_max_values(var1)
 
         # Convert the DataFrame to a GeoDataFrame
         gdf_max = gpd.GeoDataFrame(df_max, geometry=gpd.points_from_xy(df_max['Sensor Centroid Longitude'],
@@ -86,10 +84,8 @@ def plot_sensor_map_tab(var1, scale_factor):
     with sensor_map_output:
         sensor_map_output.clear_output()
         a = AggData("PM2.5")
-        df1 = Remove_Suspect(var1.df)
-
-        # Group by 'Sensor Centroid Latitude' and 'Sensor Centroid Longitude', and take the maximum 'Value'
-        df_max = df1.groupby(['Sensor Centroid Latitude', 'Sensor Centroid Longitude'])['Value'].max().reset_index()
+        # Maximum 'Value' per sensor, computed once per version of the data so rescaling only redraws
+        df_max = cached_sensor_max_values(var1)
 
         # Convert the DataFrame to a GeoDataFrame
         gdf_max = gpd.GeoDataFrame(df_max, geometry=gpd.points_from_xy(df_max['Sensor Centroid Longitude'],
@@ -108,11 +104,11 @@ def plot_prophet_forecast_tab(var1):
 def plot_choropleth_tab(var1):
     with choropleth_output:
         choropleth_output.clear_output(wait=True)
-        var1.df_downsampled = Remove_Suspect(var1.df)
+        var1.df_downsampled = cached_clean(var1)
         var1.downsample()
-        gdf = gpd.GeoDataFrame(var1.df_downsampled,
-                               geometry=gpd.points_from_xy(var1.df_downsampled['Sensor Centroid Longitude'],
-                                                           var1.df_downsampled['Sensor Centroid Latitude']))
+        # Web Mercator coordinates are projected once per sensor in the registry, not once per row
+        x, y = sensor_registry.mercator(var1.df_downsampled['Sensor ID'])
+        gdf = gpd.GeoDataFrame(var1.df_downsampled, geometry=gpd.points_from_xy(x, y), crs="EPSG:3857")
         plot_choropleth(gdf)
 
 
@@ -142,8 +138,8 @@ variable_selector2 = widgets.Dropdown(
     description='Variable 2:'
 )
 
-variable_selector1.options = ['PM2.5', 'PM10', 'O3', 'NO2', 'Humidity', 'Wind Speed', 'CO']
-variable_selector2.options = ['PM2.5', 'PM10', 'O3', 'NO2', 'Humidity', 'Wind Speed', 'CO']
+variable_selector1.options = VARIABLES
+variable_selector2.options = VARIABLES
 
 remove_outliers_checkbox = widgets.Checkbox(
     value=True,
@@ -172,6 +168,22 @@ def fetch_agg(variable1, _days):
     return selected_agg_data1
 
 
+def fetch_aggs(variables, _days):
+    print(f"Fetching data for variables {variables} and days {_days}")
+
+    # Reuse existing AggData instances, then fetch the missing variables concurrently
+    found = {}
+    for instance in AggData.instances:
+        variable = instance.data_params["data_variable"]
+        if variable in variables and instance.days == _days and variable not in found:
+            found[variable] = instance
+
+    missing = [variable for variable in variables if variable not in found]
+    found.update(zip(missing, AggData.fetch_many(missing, _days)))
+
+    return [found[variable] for variable in variables]
+
+
 last_selected_variables = [None, None]
 
 
@@ -247,7 +259,7 @@ tab_widget.observe(update_plot_output, names='selected_index')
 scale_factor_slider = widgets.FloatSlider(value=12, min=1, max=100, step=1, description='Scale Factor:',
                                           layout=Layout(width='50%'))
 days_slider = widgets.SelectionSlider(
-    options=[1, 3, 7, 28],
+    options=DAY_OPTIONS,
     value=7,
     description='Days:',
     layout=Layout(width='50%'),
@@ -326,14 +338,13 @@ def update_all_plot_outputs():
 
 
 def create_gauges():
-    pm25 = fetch_agg('PM2.5', 1)
-    pm10 = fetch_agg('PM10', 1)
-    no2 = fetch_agg('NO2', 1)
+    # Fetching the last day keeps the rolling averages up to date
+    fetch_aggs(['PM2.5', 'PM10', 'NO2'], 1)
     # Create the gauge charts
     # Pass in 24hr mean
-    pm25_gauge = create_gauge("PM2.5", pm25.get_mean_average())
-    pm10_gauge = create_gauge("PM10", pm10.get_mean_average())
-    no2_gauge = create_gauge("NO2", no2.get_mean_average())
+    pm25_gauge = create_gauge("PM2.5", rolling_averages.get('PM2.5')[0])
+    pm10_gauge = create_gauge("PM10", rolling_averages.get('PM10')[0])
+    no2_gauge = create_gauge("NO2", rolling_averages.get('NO2')[0])
     # Create a VBox for the gauges
     return VBox([go.FigureWidget(pm25_gauge), go.FigureWidget(no2_gauge)])
     # return VBox([go.FigureWidget(pm25_gauge), go.FigureWidget(pm10_gauge)])
@@ -1,13 +1,54 @@
-from flask import Flask, jsonify, request
+import math
+import os
+from datetime import datetime, timedelta
+
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS, cross_origin
-from AggData import AggData
-from RemoveOutliers import Remove_Suspect, iqr_method
+from AggData import AggData, DAY_OPTIONS, VARIABLES
+from DataCache import data_cache
+from ForecastService import forecast_service
+from LiveFeed import live_feed, sse_message
+from MapLayers import layer_cache, sensor_max_layer
+from Prefetch import prefetcher
+from RemoveOutliers import cached_clean, online_outliers
+from RollingAverages import rolling_averages
+from SensorRegistry import sensor_registry
+from Serialization import PRIVATE_COLUMNS, negotiate_encoding, negotiate_format, serialize
 
 app = Flask(__name__)
 CORS(app)
 
 app.config['CORS_HEADERS'] = 'Content-Type'
 
+# Most points returned per sensor by the data endpoints unless the client asks for fewer
+DEFAULT_MAX_POINTS = 500
+
+# Seconds between keep-alive comments on live streams, so proxies don't close idle connections
+LIVE_HEARTBEAT = 30
+# Most variables a single live stream can follow
+MAX_LIVE_VARIABLES = 32
+
+# Variables and window that get per-sensor forecasts after background refreshes
+SENSOR_FORECAST_VARIABLES = ['PM2.5', 'PM10', 'NO2']
+SENSOR_FORECAST_DAYS = 7
+
+
+def parse_bool(value, default=False):
+    if value is None:
+        return default
+    return value.lower() in ('true', '1', 'yes')
+
+
+def parse_days(value, default=1):
+    # Only the windows the dashboard offers, a longer one would grow the stored series for good
+    try:
+        days = default if value is None else int(value)
+    except (TypeError, ValueError):
+        days = None
+    if days not in DAY_OPTIONS:
+        raise ValueError(f"days must be one of {', '.join(str(option) for option in DAY_OPTIONS)}")
+    return days
+
 
 @app.route("/")
 @cross_origin()
@@ -15,27 +56,299 @@ def helloWorld():
     return "Hello, cross-origin-world!"
 
 
-if __name__ == '__main__':
-    app.run()
+def data_response(df, mimetype):
+    # Serialize in the negotiated format, compressed if the client accepts it
+    body, encoding = serialize(df, mimetype, negotiate_encoding(request.accept_encodings))
+    response = app.response_class(body, mimetype=mimetype)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.update(['Accept', 'Accept-Encoding'])
+    return response
+
 
 @app.route('/data', methods=['POST'])
 def process_data():
     content = request.json
     variable = content['variable']
-    days = content.get('days', 1)
+    try:
+        days = parse_days(content.get('days'))
+        mimetype = negotiate_format(request.accept_mimetypes, content.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     # Initialize AggData
-    data_instance = AggData(variable, days)
+    data_instance = AggData(variable, days, register=False)
     data_instance.downsample()
 
     # Remove suspect and outlier data
-    clean_data = Remove_Suspect(data_instance.df)
-    clean_data = iqr_method(clean_data)
+    clean_data = cached_clean(data_instance, remove_outliers=True)
+
+    return data_response(clean_data, mimetype)
+
+
+@app.route('/api/data/<pollutant>', methods=['GET'])
+def get_pollutant_data(pollutant):
+    # true for the IQR method over the window, or online for the outliers flagged as the data arrived
+    remove_outliers = request.args.get('remove_outliers')
+    remove_outliers = 'online' if remove_outliers == 'online' else parse_bool(remove_outliers)
+    per_sensor = parse_bool(request.args.get('per_sensor'))
+    # e.g. ?agg=mean,max,p90, the first goes to 'Value'
+    aggregations = tuple(request.args.get('agg', 'mean').split(','))
+    # Target points per sensor, usually the chart width, and how to pick them
+    points = request.args.get('points', type=int)
+    method = request.args.get('decimate', 'lttb')
+    try:
+        days = parse_days(request.args.get('days'))
+        max_points = min(request.args.get('max_points', DEFAULT_MAX_POINTS, type=int), DEFAULT_MAX_POINTS)
+        if max_points < 1:
+            raise ValueError("max_points must be at least 1")
+        # Decimation keeps the first and last point of each series and at least one between
+        if points is not None and points < 3:
+            raise ValueError("points must be at least 3")
+        # ?format=records|columnar|arrow, or the Accept header
+        mimetype = negotiate_format(request.accept_mimetypes, request.args.get('format'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    data_instance = AggData(pollutant, days, register=False)
+
+    # Unchanged data and options give the same ETag, so a repeat poll costs a 304 with no body
+    etag = (f"{pollutant}-{days}-{data_instance.version}-{remove_outliers}-{int(per_sensor)}-{max_points}"
+            f"-{'.'.join(aggregations)}-{points}-{method}-{mimetype}")
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        # Remove suspect data, and outliers if requested, then downsample
+        data_instance.df_downsampled = cached_clean(data_instance, remove_outliers, per_sensor)
+        try:
+            if points is None:
+                data_instance.downsample(aggregations)
+            else:
+                # Keep the stored 15 minute periods, averaging them into the default budget's buckets first would
+                # flatten the peaks decimation is there to keep. Decimate within max_points, so the even thinning
+                # below doesn't drop them either
+                data_instance.downsample(aggregations,
+                                         frequency=data_instance.get_target_frequency(days, point_budget=math.inf))
+                data_instance.decimate(max(min(points, max_points), 3), method)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        data_instance.limit_points_per_sensor(max_points)
+
+        response = data_response(data_instance.df_downsampled, mimetype)
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.update(['Accept', 'Accept-Encoding'])
+    return response
+
+
+def layer_response(layer, etag):
+    # Layers are stored already serialized and gzipped, so serving one is just picking a body
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    elif request.accept_encodings['gzip'] > 0:
+        response = app.response_class(layer['gzip'], mimetype='application/geo+json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = app.response_class(layer['json'], mimetype='application/geo+json')
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/api/layers/<pollutant>', methods=['GET'])
+def get_sensor_max_layer(pollutant):
+    try:
+        days = parse_days(request.args.get('days'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    layer = sensor_max_layer(pollutant, days)
+    return layer_response(layer, f"layer-{pollutant}-{days}-{layer['version']}")
+
+
+@app.route('/api/layers/<pollutant>/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_sensor_max_tile(pollutant, z, x, y):
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({'error': 'Tile out of range'}), 404
+    try:
+        days = parse_days(request.args.get('days'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    layer = sensor_max_layer(pollutant, days, (z, x, y))
+    return layer_response(layer, f"layer-{pollutant}-{days}-{layer['version']}-{z}-{x}-{y}")
+
+
+def sync_sensors():
+    # Sensors in series another worker process fetched
+    for variable in VARIABLES:
+        AggData.sync_from_store(variable)
+
+
+@app.route('/api/sensors', methods=['GET'])
+def get_sensors():
+    sync_sensors()
+    # Optional ?bbox=west,south,east,north in degrees
+    bbox = request.args.get('bbox')
+    if bbox is None:
+        sensors = sensor_registry.frame()
+    else:
+        try:
+            west, south, east, north = (float(value) for value in bbox.split(','))
+        except ValueError:
+            return jsonify({'error': 'bbox must be west,south,east,north'}), 400
+        sensors = sensor_registry.within_bbox(west, south, east, north)
+    # Registry ids are only meaningful inside this process
+    sensors = sensors.drop(columns=PRIVATE_COLUMNS, errors='ignore')
+    return app.response_class(sensors.to_json(orient='records'), mimetype='application/json')
+
+
+@app.route('/api/sensors/nearest', methods=['GET'])
+def get_nearest_sensors():
+    lon = request.args.get('lon', type=float)
+    lat = request.args.get('lat', type=float)
+    if lon is None or lat is None:
+        return jsonify({'error': 'lon and lat are required'}), 400
+    sync_sensors()
+    sensors = sensor_registry.nearest(lon, lat, request.args.get('k', 1, type=int))
+    sensors = sensors.drop(columns=PRIVATE_COLUMNS, errors='ignore')
+    return app.response_class(sensors.to_json(orient='records'), mimetype='application/json')
+
+
+@app.route('/api/live', methods=['GET'])
+def live_updates():
+    """
+    Server-Sent Events stream of 'updated' notices for several variables, sent as new aggregation periods are stored.
+
+    A dashboard opens one stream for every variable it shows, e.g. ?variables=PM2.5,NO2, and re-requests a
+    variable's views when it gets a notice for it. A reconnecting browser sends Last-Event-ID and is re-sent
+    notices for anything stored since. A 'reload' event means the client fell behind and should reload everything.
+    """
+
+    # Read before streaming, the generator runs outside the request context
+    variables = sorted({variable for value in request.args.getlist('variables') for variable in value.split(',')
+                        if variable})
+    if not variables or len(variables) > MAX_LIVE_VARIABLES:
+        return jsonify({'error': f"variables must list between 1 and {MAX_LIVE_VARIABLES} variables"}), 400
+    last_event_id = request.headers.get('Last-Event-ID')
+    try:
+        since = datetime.fromisoformat(last_event_id) if last_event_id else None
+    except ValueError:
+        # Not an id we sent, re-send everything
+        since = datetime.min + timedelta(days=1)
+    subscription = live_feed.subscribe(variables)
+
+    def stream():
+        try:
+            yield f"retry: {int(live_feed.poll_interval * 1000)}\n\n"
+            if since is not None:
+                yield from live_feed.missed(variables, since)
+            while True:
+                message = subscription.next_message(timeout=LIVE_HEARTBEAT)
+                if subscription.overflowed:
+                    yield sse_message({}, event='reload')
+                    return
+                yield message if message is not None else ": keep-alive\n\n"
+        finally:
+            live_feed.unsubscribe(subscription)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/data/<pollutant>/memory', methods=['GET'])
+def get_pollutant_memory(pollutant):
+    try:
+        days = parse_days(request.args.get('days'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(AggData(pollutant, days, register=False).memory_report())
+
+
+@app.route('/api/averages', methods=['GET'])
+def get_averages():
+    # Accept ?variable=PM2.5&variable=NO2 as well as ?variable=PM2.5,NO2
+    variables = [variable for value in request.args.getlist('variable') for variable in value.split(',') if variable]
+
+    # Served from the running aggregates kept up to date by fetches and the shared store, never from the upstream API
+    result = {'window_hours': rolling_averages.window.total_seconds() / 3600, 'last_update': {}}
+    for variable in variables:
+        if variable in VARIABLES:
+            # Catch up on rows another worker process fetched into the store
+            AggData.sync_from_store(variable)
+        mean, last_update = rolling_averages.get(variable)
+        result[variable] = mean
+        result['last_update'][variable] = last_update.isoformat() if last_update else None
+    return jsonify(result)
+
+
+@app.route('/api/forecast/<pollutant>', methods=['GET'])
+def get_forecast(pollutant):
+    try:
+        days = parse_days(request.args.get('days'), default=7)
+        result, job = forecast_service.get(pollutant, days, request.args.get('backend'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # No forecast yet, tell the client to come back once the job has finished
+    if result is None:
+        return jsonify({'forecast': None, 'job': job}), 202
+
+    return jsonify({
+        'forecast': result['forecast'],
+        'mae': result['mae'],
+        'fitted_at': result['fitted_at'],
+        'fit_seconds': result['fit_seconds'],
+        'warm_start': result['warm_start'],
+        'backend': result['backend'],
+        'job': job,
+    })
+
+
+@app.route('/api/forecast/<pollutant>/sensors', methods=['GET', 'POST'])
+def sensor_forecasts(pollutant):
+    backend = request.args.get('backend')
+    try:
+        days = parse_days(request.args.get('days'), default=SENSOR_FORECAST_DAYS)
+        if request.method == 'POST':
+            return jsonify(forecast_service.start_sensor_batch(pollutant, days, backend)), 202
+        return jsonify(forecast_service.sensor_forecasts(pollutant, days, backend))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+def schedule_sensor_forecasts():
+    # start_sensor_batch skips variables whose last batch is still running or recent enough
+    for variable in SENSOR_FORECAST_VARIABLES:
+        forecast_service.start_sensor_batch(variable, SENSOR_FORECAST_DAYS)
+
+
+prefetcher.hooks.append(schedule_sensor_forecasts)
+
+
+@app.route('/api/forecast/history', methods=['GET'])
+def get_forecast_history():
+    return jsonify(forecast_service.history())
+
+
+@app.route('/api/forecast/jobs/<job_id>', methods=['GET'])
+def get_forecast_job(job_id):
+    job = forecast_service.job_status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
 
-    # Convert to JSON
-    result = clean_data.to_json(orient='records')
-    return jsonify({'data': result})
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(dict(data_cache.stats(), layers=layer_cache.stats(), outliers=online_outliers.stats(),
+                        prefetch=prefetcher.status(), live=live_feed.stats()))
 
 
 if __name__ == '__main__':
+    # Development server. In production run wsgi:app under gunicorn, see gunicorn.conf.py
+    # With the reloader only the child process serves requests, so only it needs the prefetcher
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        prefetcher.start()
     app.run(debug=True)
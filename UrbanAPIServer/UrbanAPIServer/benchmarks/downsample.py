@@ -0,0 +1,99 @@
+"""
+Rows out and time taken by AggData.downsample against the resample-and-merge it replaced, for 100 sensors over
+1, 3, 7 and 28 days of 15 minute medians.
+
+Usage: python benchmarks/downsample.py [--sensors 100] [--repeat 5]
+
+The old downsample resampled every sensor's 'Value' into one series of bucket means, then merged it back onto the
+input rows on 'Timestamp'. The means mixed all sensors together, and only the rows falling exactly on a bucket
+boundary survived the merge. 'old error' is how far its values were from each sensor's own bucket mean, on average.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AggData import AggData  # noqa: E402
+from SensorRegistry import sensor_registry  # noqa: E402
+
+DAYS = [1, 3, 7, 28]
+
+
+def old_downsample(df, frequency):
+    df = df.set_index('Timestamp')
+    df_resampled = df['Value'].resample(frequency).mean().to_frame().reset_index()
+    return pd.merge(df_resampled, df.drop('Value', axis=1), on='Timestamp')
+
+
+def readings(sensors, days):
+    """
+    Returns compact rows, as the shared cache holds them, for sensors reporting every 15 minutes over days.
+    """
+
+    timestamps = pd.date_range('2024-01-01', periods=days * 96, freq='15min')
+    rng = np.random.default_rng(0)
+    rows = sensors * len(timestamps)
+    df = pd.DataFrame({
+        'Sensor Name': pd.Categorical(np.repeat([f"PER_AIRMON_MONITOR{i:04d}" for i in range(sensors)],
+                                                len(timestamps))),
+        'Variable': pd.Categorical(['PM2.5'] * rows),
+        'Units': pd.Categorical(['ugm -3'] * rows),
+        'Timestamp': np.tile(timestamps, sensors),
+        'Value': rng.gamma(2, 5, rows).astype(np.float32),
+        'Flagged as Suspect Reading': rng.random(rows) < 0.05,
+        'Sensor Centroid Longitude': np.repeat(rng.uniform(-1.7, -1.5, sensors), len(timestamps)),
+        'Sensor Centroid Latitude': np.repeat(rng.uniform(54.9, 55.05, sensors), len(timestamps)),
+    })
+    return sensor_registry.compact(df)
+
+
+def best_time(fn, repeat):
+    # Best of several runs, the least disturbed by anything else on the machine
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def new_downsample(df, days):
+    instance = AggData.__new__(AggData)
+    instance.days = days
+    instance.data_params = AggData.build_data_params('PM2.5', days)
+    instance.df_downsampled = df
+    # downsample reports the frequency it picked on every call
+    with contextlib.redirect_stdout(io.StringIO()):
+        instance.downsample()
+    return instance.df_downsampled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, default=100, help="Sensors in each window. Defaults to 100.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per window, the best is reported. Defaults to 5.")
+    args = parser.parse_args()
+
+    print(f"{'days':>4} {'freq':>5} {'rows in':>8} {'old rows':>9} {'old ms':>7} {'old error':>9} {'new rows':>9} "
+          f"{'new ms':>7} {'new/sensor':>10}")
+    for days in DAYS:
+        df = readings(args.sensors, days)
+        frequency = AggData.__new__(AggData).get_target_frequency(days)
+        old, old_df = best_time(lambda: old_downsample(df, frequency), args.repeat)
+        new, new_df = best_time(lambda: new_downsample(df, days), args.repeat)
+        both = pd.merge(old_df, new_df, on=['Sensor ID', 'Timestamp'], suffixes=(' old', ' new'))
+        error = (both['Value old'] - both['Value new']).abs().mean()
+        print(f"{days:>4} {frequency:>5} {len(df):>8} {len(old_df):>9} {old * 1000:>7.1f} {error:>9.2f} "
+              f"{len(new_df):>9} {new * 1000:>7.1f} {len(new_df) // args.sensors:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Startup and per-module import time report for the API server, and a check that starting it doesn't import the
+plotting, notebook, geo or forecasting stacks.
+
+Usage: python benchmarks/import_time.py [--top 25]
+
+Imports app in a fresh interpreter under -X importtime, prints the slowest imports and the total, and exits
+with status 1 if any module in HEAVY_MODULES was imported. Those are only loaded by the routes that need them.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ['matplotlib', 'seaborn', 'IPython', 'ipywidgets', 'plotly', 'prophet', 'cmdstanpy', 'sklearn',
+                 'scipy', 'geopandas', 'shapely', 'folium', 'contextily']
+
+STARTUP = """
+import json, sys, time
+start = time.perf_counter()
+import app
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Parses -X importtime output into (module, self_us, cumulative_us, depth) tuples, in import order.
+    """
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=25, help="Slowest imports to list. Defaults to 25.")
+    args = parser.parse_args()
+
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP], cwd=SERVER_DIR,
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        print(process.stderr)
+        sys.exit(process.returncode)
+    startup = json.loads(process.stdout.strip().splitlines()[-1])
+    imports = parse_importtime(process.stderr)
+
+    print(f"{'cumulative ms':>13} {'self ms':>8}  module")
+    for name, self_us, cumulative_us, depth in sorted(imports, key=lambda item: -item[2])[:args.top]:
+        print(f"{cumulative_us / 1000:>13.1f} {self_us / 1000:>8.1f}  {'  ' * (depth - 1)}{name}")
+    print(f"\n{len(imports)} modules, app imported in {startup['seconds']:.2f}s")
+
+    loaded = sorted({module.split('.')[0] for module in startup['modules']} & set(HEAVY_MODULES))
+    if loaded:
+        print(f"Imported at startup but should be lazy: {', '.join(loaded)}")
+        sys.exit(1)
+    print(f"None of {', '.join(HEAVY_MODULES)} imported at startup")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Peak memory of parsing 1, 3, 7 and 28-day upstream CSV payloads, streamed (UpstreamClient.fetch_csv) against
+buffered (the whole body as a string, wrapped in a StringIO).
+
+Usage: python benchmarks/ingest_memory.py [--sensors 100]
+
+The upstream API is replaced by a stub that streams a generated CSV from a temporary file, so nothing is fetched.
+Each measurement runs in a fresh process, as peak RSS only ever grows within one.
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DAYS = [1, 3, 7, 28]
+PERIODS_PER_DAY = 96  # 15 minute aggregation
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def write_payload(path, days, sensors):
+    """
+    Writes a CSV shaped like the aggregated endpoint's, one day at a time so generating it stays small.
+    """
+
+    rng = np.random.default_rng(0)
+    names = np.array([f"PER_AIRMON_MONITOR{i:04d}" for i in range(sensors)])
+    lon = rng.uniform(-1.7, -1.5, sensors)
+    lat = rng.uniform(54.9, 55.05, sensors)
+    start = datetime(2024, 1, 1)
+    for day in range(days):
+        timestamps = pd.date_range(start + timedelta(days=day), periods=PERIODS_PER_DAY, freq='15min')
+        rows = sensors * PERIODS_PER_DAY
+        pd.DataFrame({
+            'Sensor Name': np.repeat(names, PERIODS_PER_DAY),
+            'Variable': 'PM2.5',
+            'Units': 'ugm -3',
+            'Timestamp': np.tile(timestamps.strftime('%Y-%m-%d %H:%M:%S'), sensors),
+            'Value': rng.gamma(2, 5, rows).round(3),
+            'Flagged as Suspect Reading': rng.random(rows) < 0.05,
+            'Sensor Centroid Longitude': np.repeat(lon, PERIODS_PER_DAY),
+            'Sensor Centroid Latitude': np.repeat(lat, PERIODS_PER_DAY),
+        }).to_csv(path, mode='a', header=day == 0, index=False)
+
+
+class StubResponse:
+    """
+    Stands in for a streamed requests.Response, reading the body from a file chunk by chunk.
+    """
+
+    status_code = 200
+    url = 'stub'
+
+    def __init__(self, path):
+        self.path = path
+
+    def iter_content(self, chunk_size=1):
+        with open(self.path, 'rb') as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    @property
+    def text(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def measure(path, mode):
+    from UpstreamClient import CSV_DTYPES, upstream
+
+    upstream.session.get = lambda url, params=None, **kwargs: StubResponse(path)
+    baseline = peak_rss_mb()
+    if mode == 'streamed':
+        df = upstream.fetch_csv({})
+    else:
+        # The ingestion path before streaming: the body as one string, then a StringIO copy of it
+        text = upstream.get({}).text
+        df = pd.read_csv(io.StringIO(text), dtype=CSV_DTYPES)
+        df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+        del text
+    return {
+        'rows': len(df),
+        'frame_mb': df.memory_usage(index=False, deep=True).sum() / 2 ** 20,
+        'peak_mb': peak_rss_mb() - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, default=100, help="Sensors in each payload. Defaults to 100.")
+    parser.add_argument('--measure', nargs=2, metavar=('PATH', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(*args.measure)))
+        return
+
+    print(f"{'days':>4} {'rows':>9} {'payload MB':>10} {'frame MB':>9} {'streamed MB':>11} {'buffered MB':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for days in DAYS:
+            path = os.path.join(tmp, f"{days}d.csv")
+            write_payload(path, days, args.sensors)
+            results = {}
+            for mode in ('streamed', 'buffered'):
+                output = subprocess.run([sys.executable, __file__, '--measure', path, mode], check=True,
+                                        capture_output=True, text=True).stdout
+                results[mode] = json.loads(output.strip().splitlines()[-1])
+            streamed = results['streamed']
+            print(f"{days:>4} {streamed['rows']:>9} {os.path.getsize(path) / 2 ** 20:>10.1f} "
+                  f"{streamed['frame_mb']:>9.1f} {streamed['peak_mb']:>11.1f} {results['buffered']['peak_mb']:>11.1f}")
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Requests per second served by gunicorn -c gunicorn.conf.py wsgi:app at 1, 4 and 16 worker processes.
+
+Usage: python benchmarks/load_test.py [--workers 1 4 16] [--duration 20] [--clients 2] [--threads 8]
+
+Each run starts the server against a stub upstream (see stub_upstream.py) and a fresh store, warms every URL in the
+mix, then has --clients processes of --threads threads request the mix in a loop for --duration seconds. Reports
+throughput, latency percentiles, errors and how many requests reached the upstream during the timed run. Workers
+share the store, so those are the prefetcher's rather than one per worker.
+"""
+
+import argparse
+import itertools
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import requests
+
+from stub_upstream import StubUpstream
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Roughly what a dashboard asks for: charts, gauges and map layers
+URLS = [
+    '/api/data/PM2.5?days=1',
+    '/api/data/PM2.5?days=7&points=600',
+    '/api/data/NO2?days=1',
+    '/api/data/PM10?days=7',
+    '/api/averages?variable=PM2.5,PM10,NO2',
+    '/api/layers/PM2.5?days=1',
+    '/api/layers/NO2?days=7',
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def hammer(base_url, duration, threads):
+    """
+    Requests URLS round-robin from several threads until duration seconds have passed. Runs in a client process.
+
+    Returns:
+    - tuple: (latencies in seconds of successful requests, number of failed requests)
+    """
+
+    deadline = time.perf_counter() + duration
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def run(offset):
+        session = requests.Session()
+        session.headers['Accept-Encoding'] = 'gzip'
+        for path in itertools.islice(itertools.cycle(URLS), offset, None):
+            if time.perf_counter() >= deadline:
+                return
+            start = time.perf_counter()
+            try:
+                ok = session.get(base_url + path, timeout=30).ok
+            except requests.RequestException:
+                ok = False
+            with lock:
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors[0] += 1
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, errors[0]
+
+
+def start_server(workers, port, store, upstream_url):
+    env = dict(os.environ, URBAN_WORKERS=str(workers), URBAN_BIND=f"127.0.0.1:{port}", URBAN_DATA_STORE=store,
+               URBAN_UPSTREAM_URL=upstream_url, URBAN_FORECAST_WORKERS='1')
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                              cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(600):
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {server.returncode}")
+        try:
+            requests.get(base_url + '/', timeout=1)
+            return server, base_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("gunicorn didn't start within a minute")
+
+
+def run(workers, args, upstream):
+    with tempfile.TemporaryDirectory() as store:
+        server, base_url = start_server(workers, free_port(), store, upstream.url)
+        try:
+            # Warm every URL, so the run measures serving rather than the first fetch of each window
+            for path in URLS:
+                requests.get(base_url + path, timeout=120).raise_for_status()
+            upstream_before = upstream.requests
+
+            with ProcessPoolExecutor(args.clients) as clients:
+                results = list(clients.map(hammer, [base_url] * args.clients, [args.duration] * args.clients,
+                                           [args.threads] * args.clients))
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(30)
+
+    latencies = np.array([latency for result in results for latency in result[0]])
+    errors = sum(result[1] for result in results)
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000 if len(latencies) else (float('nan'),) * 2
+    print(f"{workers:>7} {len(latencies) / args.duration:>9.1f} {p50:>7.1f} {p95:>7.1f} {errors:>6} "
+          f"{upstream.requests - upstream_before:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16], help="Worker counts to run.")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds of load per run. Defaults to 20.")
+    parser.add_argument('--clients', type=int, default=2, help="Client processes. Defaults to 2.")
+    parser.add_argument('--threads', type=int, default=8, help="Threads per client process. Defaults to 8.")
+    parser.add_argument('--upstream-delay', type=float, default=0.2,
+                        help="Seconds the stub upstream takes to answer. Defaults to 0.2.")
+    args = parser.parse_args()
+
+    upstream = StubUpstream(delay=args.upstream_delay).start()
+    print(f"{args.clients * args.threads} concurrent clients, {args.duration:.0f}s per run, "
+          f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>7} {'p95 ms':>7} {'errors':>6} {'upstream':>8}")
+    try:
+        for workers in args.workers:
+            run(workers, args, upstream)
+    finally:
+        upstream.stop()
+
+
+if __name__ == '__main__':
+    main()
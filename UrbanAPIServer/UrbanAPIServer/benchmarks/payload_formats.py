@@ -0,0 +1,80 @@
+"""
+Bytes on the wire and serialization time of /api/data windows for 100 sensors in each response format (row records,
+columnar JSON, Arrow IPC) and encoding (none, gzip, br), against the old double-encoded records.
+
+Usage: python benchmarks/payload_formats.py [--sensors 100] [--repeat 5]
+
+Windows are downsampled as /api/data serves them by default. The old process_data wrapped the to_json string in
+jsonify, escaping it a second time. br is skipped if the optional brotli package isn't installed, as the server does.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AggData import AggData  # noqa: E402
+from Serialization import FORMATS, brotli, serialize  # noqa: E402
+from SensorRegistry import sensor_registry  # noqa: E402
+from downsample import readings  # noqa: E402
+
+DAYS = [1, 7, 28]
+ENCODINGS = [None, 'gzip'] + (['br'] if brotli is not None else [])
+
+
+def window(sensors, days):
+    """
+    Returns the frame /api/data would serialize for the window, expanded to the columns clients see.
+    """
+
+    instance = AggData.__new__(AggData)
+    instance.days = days
+    instance.data_params = AggData.build_data_params('PM2.5', days)
+    instance.df_downsampled = sensor_registry.expand(readings(sensors, days))
+    # downsample reports the frequency it picked
+    with contextlib.redirect_stdout(io.StringIO()):
+        instance.downsample()
+    return instance.df_downsampled
+
+
+def best_time(fn, repeat):
+    # Best of several runs, the least disturbed by anything else on the machine
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def old_records(df):
+    return json.dumps(df.to_json(orient='records')).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sensors', type=int, default=100, help="Sensors in each window. Defaults to 100.")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per payload, the best is reported. Defaults to 5.")
+    args = parser.parse_args()
+
+    print(f"{'window':>6} {'rows':>7} {'format':>8} {'encoding':>8} {'KB':>9} {'ms':>8}")
+    for days in DAYS:
+        df = window(args.sensors, days)
+        label = f"{days}d"
+
+        elapsed, body = best_time(lambda: old_records(df), args.repeat)
+        print(f"{label:>6} {len(df):>7} {'old':>8} {'-':>8} {len(body) / 1024:>9.1f} {elapsed * 1000:>8.1f}")
+        for name, mimetype in FORMATS.items():
+            for encoding in ENCODINGS:
+                elapsed, (body, _) = best_time(lambda: serialize(df, mimetype, encoding), args.repeat)
+                print(f"{label:>6} {len(df):>7} {name:>8} {encoding or '-':>8} {len(body) / 1024:>9.1f} "
+                      f"{elapsed * 1000:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Latency of dashboard polls that arrive just after their cached window expired, against a slow upstream, with and
+without serving the expired window while it refreshes (DataCache's stale_ttl).
+
+Usage: python benchmarks/slow_upstream.py [--delay 2] [--polls 200] [--threads 100] [--sensors 10]
+
+Runs the app in this process against a stub upstream (see stub_upstream.py) that sleeps --delay seconds per request.
+Each run warms /api/data/PM2.5?days=1, expires the cached window and empties the store, so refreshing it needs a
+full upstream round trip, then sends --polls requests for it from --threads threads at once. On a single CPU most of
+the time is serving the polls rather than waiting on the upstream, lower --sensors to see the wait more clearly.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from stub_upstream import StubUpstream
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+URL = '/api/data/PM2.5?days=1'
+STALE_TTLS = [0, 6 * 60 * 60]
+
+
+def poll(app, polls, threads):
+    """
+    Requests URL polls times from several threads at once.
+
+    Returns:
+    - tuple: (latencies in seconds of successful requests, number of failed requests)
+    """
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = iter(range(polls))
+    start_together = threading.Barrier(threads)
+
+    def run():
+        client = app.test_client()
+        start_together.wait()
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            ok = client.get(URL).status_code == 200
+            with lock:
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors[0] += 1
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return np.array(latencies), errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--delay', type=float, default=2, help="Seconds the stub upstream takes to answer. "
+                                                               "Defaults to 2.")
+    parser.add_argument('--polls', type=int, default=200, help="Requests per run. Defaults to 200.")
+    parser.add_argument('--threads', type=int, default=100, help="Threads sending them. Defaults to 100.")
+    parser.add_argument('--sensors', type=int, default=10, help="Sensors in the window. Defaults to 10.")
+    args = parser.parse_args()
+
+    upstream = StubUpstream(delay=args.delay, sensors=args.sensors).start()
+    store = tempfile.mkdtemp()
+    # Both are read when the modules are imported
+    os.environ['URBAN_UPSTREAM_URL'] = upstream.url
+    os.environ['URBAN_DATA_STORE'] = store
+
+    from AggData import AggData
+    from DataCache import data_cache
+    from app import app
+
+    print(f"{args.polls} polls on {args.threads} threads for {args.sensors} sensors, upstream takes "
+          f"{args.delay:.1f}s, {os.cpu_count()} CPUs")
+    print(f"{'stale ttl':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>6} {'upstream':>8}")
+    try:
+        for stale_ttl in STALE_TTLS:
+            data_cache.invalidate()
+            data_cache.stale_ttl = stale_ttl
+            with contextlib.redirect_stdout(io.StringIO()):
+                if app.test_client().get(URL).status_code != 200:
+                    raise RuntimeError(f"Warming {URL} failed")
+
+            # Expire every cached window and forget the series, so the refresh has to go to the upstream API
+            with data_cache._lock:
+                for key, (value, stored_at, version) in data_cache._entries.items():
+                    data_cache._entries[key] = (value, stored_at - data_cache.ttl, version)
+            AggData.series.clear()
+            shutil.rmtree(store)
+            os.makedirs(store)
+            upstream_before = upstream.requests
+
+            # The app logs every request, keep the table readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies, errors = poll(app, args.polls, args.threads)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+            print(f"{stale_ttl:>9} {p50:>8.0f} {p99:>8.0f} {latencies.max() * 1000:>8.0f} {errors:>6} "
+                  f"{upstream.requests - upstream_before:>8}")
+    finally:
+        upstream.stop()
+        shutil.rmtree(store, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
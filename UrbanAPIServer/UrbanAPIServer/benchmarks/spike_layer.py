@@ -0,0 +1,55 @@
+"""
+Time to build the sensor spike layer with MapGeneration.spike_feature_collection for 100, 10k and 100k sensors,
+and to serialize it to GeoJSON.
+
+Usage: python benchmarks/spike_layer.py [--repeat 5]
+
+Only NumPy is needed, sensors are placed at random around Newcastle.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from MapGeneration import spike_feature_collection  # noqa: E402
+
+SENSORS = [100, 10_000, 100_000]
+
+
+def best_time(fn, repeat):
+    # Best of several runs, the least disturbed by anything else on the machine
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per size, the best is reported. Defaults to 5.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'sensors':>8} {'build ms':>9} {'us/sensor':>9} {'json ms':>8} {'json MB':>8}")
+    for sensors in SENSORS:
+        lon = rng.uniform(-1.75, -1.45, sensors)
+        lat = rng.uniform(54.9, 55.1, sensors)
+        values = rng.gamma(2, 5, sensors)
+        lengths = values * 100  # create_sensor_spike_map_folium's default scale factor
+
+        build, layer = best_time(lambda: spike_feature_collection(lon, lat, values, lengths), args.repeat)
+        dump, body = best_time(lambda: json.dumps(layer, separators=(',', ':')).encode(), args.repeat)
+        print(f"{sensors:>8} {build * 1000:>9.1f} {build / sensors * 1e6:>9.2f} {dump * 1000:>8.1f} "
+              f"{len(body) / 2 ** 20:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Local stand-in for the Urban Observatory aggregated CSV endpoint, for benchmarks that run the server.
+
+Answers every request with generated 15 minute medians for the requested variable and time range, optionally
+after a delay, and counts the requests it served. Point the server at it with URBAN_UPSTREAM_URL.
+"""
+
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+
+def csv_payload(params, sensors=50):
+    """
+    Returns a CSV body shaped like the aggregated endpoint's for the query parameters of a request.
+
+    Parameters:
+    - params (dict): The request's data_variable, starttime and endtime.
+    - sensors (int, optional): Sensors in the response. Defaults to 50.
+
+    Returns:
+    - bytes: The CSV body.
+    """
+
+    start = datetime.strptime(params['starttime'], '%Y%m%d%H%M%S')
+    end = datetime.strptime(params['endtime'], '%Y%m%d%H%M%S')
+    timestamps = pd.date_range(pd.Timestamp(start).ceil('15min'), end, freq='15min')
+    rng = np.random.default_rng(int(timestamps[0].timestamp()) if len(timestamps) else 0)
+    periods = len(timestamps)
+    rows = sensors * periods
+    return pd.DataFrame({
+        'Sensor Name': np.repeat([f"PER_AIRMON_MONITOR{i:04d}" for i in range(sensors)], periods),
+        'Variable': params['data_variable'],
+        'Units': 'ugm -3',
+        'Timestamp': np.tile(timestamps.strftime('%Y-%m-%d %H:%M:%S'), sensors),
+        'Value': rng.gamma(2, 5, rows).round(3),
+        'Flagged as Suspect Reading': rng.random(rows) < 0.05,
+        'Sensor Centroid Longitude': np.repeat(np.linspace(-1.7, -1.5, sensors), periods),
+        'Sensor Centroid Latitude': np.repeat(np.linspace(54.9, 55.05, sensors), periods),
+    }).to_csv(index=False).encode()
+
+
+class StubUpstream:
+    """
+    Serves csv_payload over HTTP on a background thread.
+
+    Parameters:
+    - delay (float, optional): Seconds to wait before answering each request, like a slow upstream. Defaults to 0.
+    - sensors (int, optional): Sensors in each response. Defaults to 50.
+    """
+
+    def __init__(self, delay=0.0, sensors=50):
+        self.delay = delay
+        self.sensors = sensors
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = {name: values[0] for name, values in parse_qs(urlparse(self.path).query).items()}
+                with stub._lock:
+                    stub.requests += 1
+                time.sleep(stub.delay)
+                body = csv_payload(params, stub.sensors)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='stub-upstream', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,18 @@
+import multiprocessing
+import os
+
+# Settings for serving wsgi:app, e.g. gunicorn -c gunicorn.conf.py wsgi:app
+
+bind = os.environ.get('URBAN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('URBAN_WORKERS', multiprocessing.cpu_count()))
+# Requests mostly wait on the upstream API and the store, so each worker also serves several on threads
+worker_class = 'gthread'
+# Each open /api/live stream holds one of these threads for as long as its dashboard stays open, so a worker only has
+# threads minus its open streams left for everything else. The default leaves room for dozens of dashboards per
+# worker; raise URBAN_THREADS if more are expected. Idle threads cost little, they are blocked on a socket or queue
+threads = int(os.environ.get('URBAN_THREADS', 64))
+# Cold fetches of long windows from the upstream API can take a while
+timeout = 120
+
+# The app starts threads and a forecast process pool on import, which must not be created before the fork
+preload_app = False
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The server's modules are imported flat, as app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the tests' Parquet store away from a real one, set before DataStore creates data_store
+os.environ.setdefault('URBAN_DATA_STORE', tempfile.mkdtemp(prefix='urban-test-store-'))
+
+SPIKE = 500.0
+
+
+class StubResponse:
+    status_code = 200
+    url = 'stub'
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def spiky_csv(params):
+    # Two sensors of 15 minute medians around 10, the first with a single spike half way through the window
+    start = datetime.strptime(params['starttime'], '%Y%m%d%H%M%S')
+    end = datetime.strptime(params['endtime'], '%Y%m%d%H%M%S')
+    timestamps = pd.date_range(pd.Timestamp(start).ceil('15min'), end, freq='15min')
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(2):
+        values = rng.normal(10, 1, len(timestamps)).round(2)
+        if i == 0:
+            values[len(values) // 2] = SPIKE
+        frames.append(pd.DataFrame({
+            'Sensor Name': f"PER_AIRMON_MONITOR{i}",
+            'Variable': params['data_variable'],
+            'Units': 'ugm -3',
+            'Timestamp': timestamps.strftime('%Y-%m-%d %H:%M:%S'),
+            'Value': values,
+            'Flagged as Suspect Reading': False,
+            'Sensor Centroid Longitude': -1.61 - i / 100,
+            'Sensor Centroid Latitude': 54.97 + i / 100,
+        }))
+    return pd.concat(frames).to_csv(index=False).encode()
+
+
+@pytest.fixture
+def stub_upstream(monkeypatch):
+    from DataCache import data_cache
+    from UpstreamClient import upstream
+
+    monkeypatch.setattr(upstream.session, 'get',
+                        lambda url, params=None, **kwargs: StubResponse(spiky_csv(params)))
+    data_cache.invalidate()
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from DataStore import data_store
+from conftest import SPIKE
+from UpstreamClient import upstream
+from app import app
+
+
+@pytest.fixture
+def client(stub_upstream):
+    return app.test_client()
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+def test_spike_survives_decimation(client, method):
+    response = client.get(f'/api/data/PM2.5?days=7&points=200&decimate={method}')
+    assert response.status_code == 200
+
+    df = pd.DataFrame(response.json)
+    rows = df.groupby('Sensor Name').size()
+    # More rows than the default 2h buckets give, but no more than asked for
+    assert (rows > 120).all() and (rows <= 200).all()
+    assert df['Value'].max() == SPIKE
+
+
+def test_points_capped_by_max_points(client):
+    response = client.get('/api/data/PM2.5?days=7&points=1200&decimate=minmax')
+    assert response.status_code == 200
+
+    df = pd.DataFrame(response.json)
+    assert df.groupby('Sensor Name').size().max() <= 500
+    assert df['Value'].max() == SPIKE
+
+
+def test_private_columns_not_served(client):
+    response = client.get('/api/data/PM2.5?days=1&remove_outliers=online')
+    assert response.status_code == 200
+    assert not {'Sensor ID', 'Outlier'} & set(response.json[0])
+
+
+def test_percentiles_served_without_float32_noise(client):
+    response = client.get('/api/data/PM2.5?days=1&agg=mean,p90')
+    assert response.status_code == 200
+
+    # Written with the shortest digits that read back to the stored float32, like 'Value'
+    for column in ('Value', 'Value p90'):
+        values = pd.DataFrame(response.json)[column]
+        assert all(repr(value) == str(np.float32(value)) for value in values)
+
+
+def test_cached_window_dropped_when_store_moves_on(client):
+    first = client.get('/api/data/NO2?days=1')
+    assert first.status_code == 200
+
+    # Another worker process fetches the next hour into the shared store
+    key = ('NO2', 'median', '15mins')
+    end = data_store.coverage(key)[1]
+    later = end + timedelta(hours=1)
+    params = dict(data_variable='NO2', starttime=end.strftime('%Y%m%d%H%M%S'), endtime=later.strftime('%Y%m%d%H%M%S'))
+    data_store.write(key, upstream.fetch_csv(params), end, later)
+
+    second = client.get('/api/data/NO2?days=1', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from RemoveOutliers import OnlineOutlierFilter
+
+
+def readings(start, end):
+    timestamps = pd.date_range(start, end, freq='15min')
+    return pd.DataFrame({
+        'Sensor ID': np.zeros(len(timestamps), dtype=np.int32),
+        'Timestamp': timestamps,
+        'Value': np.random.default_rng(0).gamma(2, 5, len(timestamps)),
+        'Flagged as Suspect Reading': False,
+    })
+
+
+def sketch_count(outliers, variable, sensor=0):
+    return sum(sketch.count for sketch in outliers.sketches[(variable, sensor)].values())
+
+
+def test_longer_window_adds_older_days():
+    outliers = OnlineOutlierFilter(window_days=7)
+    outliers.observe('PM2.5', readings('2024-01-07', '2024-01-07 23:45'))
+    assert sketch_count(outliers, 'PM2.5') == 96
+
+    # A 7-day fetch after the 1-day one, overlapping it completely
+    outliers.observe('PM2.5', readings('2024-01-01', '2024-01-07 23:45'))
+    assert sketch_count(outliers, 'PM2.5') == 7 * 96
+
+
+def test_refetched_readings_counted_once():
+    outliers = OnlineOutlierFilter(window_days=7)
+    outliers.observe('PM2.5', readings('2024-01-01', '2024-01-02'))
+    # The tail re-requests the last period along with the new ones
+    outliers.observe('PM2.5', readings('2024-01-02', '2024-01-02 03:00'))
+    assert sketch_count(outliers, 'PM2.5') == len(readings('2024-01-01', '2024-01-02 03:00'))
+
+
+def test_days_outside_window_dropped():
+    outliers = OnlineOutlierFilter(window_days=7)
+    outliers.observe('PM2.5', readings('2024-01-01', '2024-01-28'))
+    days = list(outliers.sketches[('PM2.5', 0)])
+    assert len(days) == 7 and days == sorted(days)
@@ -0,0 +1,19 @@
+from DataStore import data_store
+from ForecastService import ForecastService, model_name
+
+
+def test_models_stored_apart_from_horizons(stub_upstream):
+    service = ForecastService(max_workers=1, default_backend='fourier')
+    key = ('CO', 3, 'fourier')
+    run = service.forecast_sensors('CO', 3)
+    assert run['status'] == 'finished' and run['series'] == 2
+
+    state = data_store.read_json('forecasts/CO_3d_fourier.sensors.json')
+    for sensor, result in state['sensors'].items():
+        assert 'model' not in result
+        assert data_store.read_json(model_name(key, sensor)) is not None
+
+    # The refit is warm started from the stored models
+    assert service.forecast_sensors('CO', 3)['series'] == 2
+    assert set(service.sensor_forecasts('CO', 3)['sensors']) == set(state['sensors'])
+    service.executor.shutdown()
@@ -0,0 +1,13 @@
+"""
+Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+
+Every worker process imports this module after the fork and builds its own caches and thread and process pools.
+The workers share the Parquet store on disk, and only the worker holding the store's prefetch lock refreshes it.
+The others catch up their running averages and sensor registry from the store, and forecast results and jobs are
+kept in the store, so any worker can answer any request.
+"""
+
+from app import app
+from Prefetch import prefetcher
+
+prefetcher.start(leader_lock='prefetch.lock')
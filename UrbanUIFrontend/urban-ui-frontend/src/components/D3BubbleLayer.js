@@ -17,9 +17,10 @@ const D3BubbleLayer = ({ data }) => {
     const path = d3Geo.geoPath().projection(transform);
 
     const createBubbles = (data) => {
-      return data.map((item) => {
-        const coords = [item['Sensor Centroid Longitude'], item['Sensor Centroid Latitude']];
-        const value = item['Value'];
+      // Points come from the server's per-sensor max layer, only the radius is derived here
+      return data.features.map((feature) => {
+        const coords = feature.geometry.coordinates;
+        const value = feature.properties['Value'];
         const radius = Math.log1p(value) * 5;
 
         return {
@@ -30,7 +31,7 @@ const D3BubbleLayer = ({ data }) => {
           },
           properties: {
             value,
-            sensorName: item['Sensor Name'],
+            sensorName: feature.properties['Sensor Name'],
             radius,
           },
         };
@@ -39,7 +40,7 @@ const D3BubbleLayer = ({ data }) => {
 
     const bubblesData = createBubbles(data);
 
-    const colorScale = d3.scaleSequential(d3.interpolateOranges).domain([0, d3.max(data, (d) => d['Value'])]);
+    const colorScale = d3.scaleSequential(d3.interpolateOranges).domain([0, d3.max(data.features, (d) => d.properties['Value'])]);
 
     const d3_features = g.selectAll("circle")
       .data(bubblesData)
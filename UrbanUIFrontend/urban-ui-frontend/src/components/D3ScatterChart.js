@@ -8,7 +8,9 @@ const D3ScatterChart = ({ width, height, pollutant = "PM2.5", days = 1, remove_o
   const theme = useTheme();
   const svgRef = useRef();
 
-  const { data, loading, error } = useDataFetch(`/api/data/${pollutant}?days=${days}`, { remove_outliers });
+  // Ask for about one point per pixel per sensor, rounded so small resizes reuse the cached response
+  const points = Math.max(100, Math.ceil((width || 0) / 100) * 100);
+  const { data, loading, error } = useDataFetch(`/api/data/${pollutant}?days=${days}&points=${points}`, { remove_outliers }, undefined, pollutant);
 
   useEffect(() => {
     if (loading || error || !data) return;
@@ -19,9 +19,10 @@ const D3SpikeLayer = ({ data }) => {
     const scaleFactor = 100;
 
     const createSpikes = (data) => {
-      return data.map((item) => {
-        const coords = [item['Sensor Centroid Longitude'], item['Sensor Centroid Latitude']];
-        const value = item['Value'];
+      // Points come from the server's per-sensor max layer, only the spike length is derived here
+      return data.features.map((feature) => {
+        const coords = feature.geometry.coordinates;
+        const value = feature.properties['Value'];
         const length = Math.log1p(value) * scaleFactor;
 
         return {
@@ -35,7 +36,7 @@ const D3SpikeLayer = ({ data }) => {
           },
           properties: {
             value,
-            sensorName: item['Sensor Name'],
+            sensorName: feature.properties['Sensor Name'],
           },
         };
       });
@@ -43,7 +44,7 @@ const D3SpikeLayer = ({ data }) => {
 
     const spikesData = createSpikes(data);
 
-    const colorScale = d3.scaleSequential(d3.interpolateYlOrRd).domain([0, d3.max(data, (d) => d['Value'])]);
+    const colorScale = d3.scaleSequential(d3.interpolateYlOrRd).domain([0, d3.max(data.features, (d) => d.properties['Value'])]);
 
     const d3_features = g.selectAll("path")
       .data(spikesData)
@@ -3,7 +3,7 @@ import { Gauge, gaugeClasses } from '@mui/x-charts/Gauge';
 import useDataFetch from '../hooks/useDataFetch';
 
 const GaugeComponent = ({ pollutant }) => {
-  const { data, loading, error } = useDataFetch('/api/averages', { variable: pollutant });
+  const { data, loading, error } = useDataFetch('/api/averages', { variable: pollutant }, undefined, pollutant);
   const value = data ? data[pollutant] : 0;
 
   let max_value = 100;
@@ -7,7 +7,7 @@ import withAutoResize from './withAutoResize';
 
 const PollutantChart = ({ width, height, pollutant, days }) => {
   const theme = useTheme();
-  const { data, loading, error } = useDataFetch(`/api/data/${pollutant}`, { days, remove_outliers: true });
+  const { data, loading, error } = useDataFetch(`/api/data/${pollutant}`, { days, remove_outliers: true }, undefined, pollutant);
 
   if (loading) return <CircularProgress />;
   if (error) return <p>Error: {error.message}</p>;
@@ -6,7 +6,7 @@ import useDataFetch from '../hooks/useDataFetch';
 import CircularProgress from '@mui/material/CircularProgress';
 
 const SpikeMap = ({ pollutant, days }) => {
-  const { data, loading, error } = useDataFetch(`/api/data/${pollutant}?days=${days}`, { remove_outliers: false });
+  const { data, loading, error } = useDataFetch(`/api/layers/${pollutant}`, { days }, undefined, pollutant);
   const center = [54.97226, -1.61731];
 
   if (loading) return <CircularProgress />;
@@ -15,7 +15,7 @@ const TimescaleDropdown = ({ timescale, setTimescale }) => {
         <MenuItem value={1}>1 Day</MenuItem>
         <MenuItem value={3}>3 Days</MenuItem>
         <MenuItem value={7}>1 Week</MenuItem>
-        <MenuItem value={30}>1 Month</MenuItem>
+        <MenuItem value={28}>4 Weeks</MenuItem>
       </Select>
     </FormControl>
   );
@@ -10,7 +10,7 @@ const ViolinPlot = ({ pollutant, width, height, showOutliers = true, days = 1 })
   const theme = useTheme();
   const isDarkMode = theme.palette.mode === 'dark';
 
-  const { data, loading, error } = useDataFetch(`/api/data/${pollutant}?days=${days}`, { remove_outliers: !showOutliers });
+  const { data, loading, error } = useDataFetch(`/api/data/${pollutant}?days=${days}`, { remove_outliers: !showOutliers }, undefined, pollutant);
 
   useEffect(() => {
     if (loading || error || !data) return;
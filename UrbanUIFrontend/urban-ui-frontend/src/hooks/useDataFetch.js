@@ -1,12 +1,14 @@
 import { useState, useEffect, useRef } from 'react';
 import fetchData from '../services/dataService';
+import subscribeLive from '../services/liveService';
 import debounce from 'lodash.debounce';
 
 const centralCache = {};
 const CACHE_DURATION = 120000; // 2 minutes in milliseconds
 const fetchQueue = {};
 
-const useDataFetch = (endpoint, params = {}, refreshInterval = CACHE_DURATION) => {
+// With liveVariable set, data is re-fetched when the server says new data for it was stored instead of on a timer
+const useDataFetch = (endpoint, params = {}, refreshInterval = CACHE_DURATION, liveVariable = null) => {
     const [data, setData] = useState(null);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
@@ -69,15 +71,29 @@ const useDataFetch = (endpoint, params = {}, refreshInterval = CACHE_DURATION) =
         const debouncedFetchDataAsync = debounce(fetchDataAsync, 300); // Debounce to avoid rapid calls
         debouncedFetchDataAsync();
 
-        const interval = setInterval(debouncedFetchDataAsync, refreshInterval);
+        let interval = null;
+        let unsubscribe = null;
+        if (liveVariable) {
+            unsubscribe = subscribeLive(liveVariable, () => {
+                delete centralCache[cacheKey];
+                debouncedFetchDataAsync();
+            });
+        } else {
+            interval = setInterval(debouncedFetchDataAsync, refreshInterval);
+        }
         return () => {
-            clearInterval(interval);
+            if (interval) {
+                clearInterval(interval);
+            }
+            if (unsubscribe) {
+                unsubscribe();
+            }
             debouncedFetchDataAsync.cancel(); // Cancel debounced calls
             if (abortControllerRef.current) {
                 abortControllerRef.current.abort();
             }
         };
-    }, [endpoint, params, refreshInterval]); // Include params and refreshInterval in the dependency array
+    }, [endpoint, params, refreshInterval, liveVariable]); // Include params and refreshInterval in the dependency array
 
     return { data, loading, error };
 };
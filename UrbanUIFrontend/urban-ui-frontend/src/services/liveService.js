@@ -0,0 +1,60 @@
+// One EventSource for every variable on the page, so a dashboard holds a single connection to the server however
+// many components follow live updates
+const listeners = {};
+let source = null;
+let sourceVariables = '';
+let reopenTimer = null;
+
+const openSource = () => {
+    reopenTimer = null;
+    const variables = Object.keys(listeners).sort().join(',');
+    if (variables === sourceVariables) {
+        return;
+    }
+
+    if (source) {
+        source.close();
+        source = null;
+    }
+    sourceVariables = variables;
+    if (!variables) {
+        return;
+    }
+
+    const url = new URL(`${process.env.REACT_APP_BACKEND_URL}/api/live`);
+    url.searchParams.set('variables', variables);
+    source = new EventSource(url);
+    source.addEventListener('updated', (event) => {
+        const { variable } = JSON.parse(event.data);
+        (listeners[variable] || []).forEach(listener => listener(variable));
+    });
+    // The server dropped us for falling behind, treat it like new data for everything
+    source.addEventListener('reload', () => {
+        Object.keys(listeners).forEach(variable => listeners[variable].forEach(listener => listener(variable)));
+    });
+};
+
+// Components mount and unmount in batches, so reopen the stream once per batch rather than once per component
+const scheduleOpen = () => {
+    if (!reopenTimer) {
+        reopenTimer = setTimeout(openSource, 0);
+    }
+};
+
+const subscribeLive = (variable, onUpdate) => {
+    if (!listeners[variable]) {
+        listeners[variable] = new Set();
+        scheduleOpen();
+    }
+    listeners[variable].add(onUpdate);
+
+    return () => {
+        listeners[variable].delete(onUpdate);
+        if (listeners[variable].size === 0) {
+            delete listeners[variable];
+            scheduleOpen();
+        }
+    };
+};
+
+export default subscribeLive;